@@ -0,0 +1,205 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import datetime
+
+import pymongo
+from cachetools import TTLCache
+
+from url_utils import canonical_url
+
+def _normalized_url_set(sitemap_urls):
+    # Same page, same key, see url_utils.canonical_url
+    return sorted({canonical_url(url) for url in sitemap_urls if url and url.strip()})
+
+def cache_key(sitemap_urls, prompt_version):
+    # Content-addressed: the prompt version plus the set of URLs, in any order.
+    # The company name is left out so identical sitemaps share one result.
+    normalized = _normalized_url_set(sitemap_urls)
+    digest = hashlib.sha256(prompt_version.encode())
+    for url in normalized:
+        digest.update(b'\n')
+        digest.update(url.encode())
+    return digest.hexdigest()
+
+def sitemap_fingerprint(sitemap_urls):
+    # Order-independent digest of a URL set, stored with each company so a
+    # rerun can tell whether its sitemap changed
+    return hashlib.sha256('\n'.join(_normalized_url_set(sitemap_urls)).encode()).hexdigest()
+
+# Persistent tier in a local SQLite file, shared by every worker on the host
+class SQLiteInsightStore:
+    def __init__(self, path, ttl, max_entries=100000, evict_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS ai_cache (
+                                key TEXT PRIMARY KEY,
+                                insights TEXT,
+                                stored_at REAL,
+                                last_access REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_cache_access ON ai_cache (last_access)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT insights, stored_at FROM ai_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        insights, stored_at = row
+        if time.time() - stored_at > self.ttl:
+            conn.execute('DELETE FROM ai_cache WHERE key = ?', (key,))
+            conn.commit()
+            return None
+        conn.execute('UPDATE ai_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        conn.commit()
+        return insights
+
+    def put(self, key, insights):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO ai_cache VALUES (?, ?, ?, ?)', (key, insights, now, now))
+        conn.commit()
+
+        with self._lock:
+            self._writes += 1
+            run_eviction = self._writes % self.evict_every == 0
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        conn = self._connect()
+        evicted = conn.execute('DELETE FROM ai_cache WHERE stored_at < ?', (time.time() - self.ttl,)).rowcount
+
+        # Least recently used entries go first once we are over the limit
+        total = conn.execute('SELECT COUNT(*) FROM ai_cache').fetchone()[0]
+        if total > self.max_entries:
+            evicted += conn.execute(
+                'DELETE FROM ai_cache WHERE key IN (SELECT key FROM ai_cache ORDER BY last_access LIMIT ?)',
+                (total - self.max_entries,)
+            ).rowcount
+        conn.commit()
+        return evicted
+
+# Persistent tier in MongoDB, shared by every worker that uses the same database.
+# Expiry is left to a TTL index on expires_at.
+class MongoInsightStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._collection = None
+
+    def _connect(self):
+        # database.db only exists once init_db() has run
+        if self._collection is None:
+            import database
+            collection = database.db['ai_cache']
+            collection.create_index([('expires_at', pymongo.ASCENDING)], expireAfterSeconds=0)
+            self._collection = collection
+        return self._collection
+
+    def get(self, key):
+        document = self._connect().find_one({'_id': key}, projection={'insights': True, 'expires_at': True})
+        if document is None:
+            return None
+        # The TTL monitor only runs once a minute
+        if document['expires_at'] < datetime.datetime.utcnow():
+            return None
+        return document['insights']
+
+    def put(self, key, insights):
+        self._connect().update_one(
+            {'_id': key},
+            {'$set': {
+                'insights': insights,
+                'expires_at': datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+            }},
+            upsert=True
+        )
+
+# In-memory LRU/TTL tier in front of an optional persistent tier
+class AICache:
+    def __init__(self, memory_size=1024, ttl=7 * 24 * 3600, persistent=None):
+        self.memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self.persistent = persistent
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'stored': 0, 'errors': 0}
+
+    def get(self, key):
+        with self._lock:
+            insights = self.memory.get(key)
+            if insights is not None:
+                self.stats['memory_hits'] += 1
+                return insights
+
+        if self.persistent is not None:
+            try:
+                insights = self.persistent.get(key)
+            except Exception as e:
+                print(f"AI cache read error: {str(e)}")
+                self._count('errors')
+                insights = None
+            if insights is not None:
+                with self._lock:
+                    self.memory[key] = insights
+                    self.stats['persistent_hits'] += 1
+                return insights
+
+        self._count('misses')
+        return None
+
+    def put(self, key, insights):
+        with self._lock:
+            self.memory[key] = insights
+            self.stats['stored'] += 1
+
+        if self.persistent is not None:
+            try:
+                self.persistent.put(key, insights)
+            except Exception as e:
+                print(f"AI cache write error: {str(e)}")
+                self._count('errors')
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self.memory)
+        lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['persistent_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+def create_ai_cache():
+    # Persistent tier from the environment: sqlite (default), mongo or none
+    backend = os.getenv('AI_CACHE_BACKEND', 'sqlite').lower()
+    memory_size = int(os.getenv('AI_CACHE_MEMORY_SIZE', '1024'))
+    ttl = int(os.getenv('AI_CACHE_TTL', str(7 * 24 * 3600)))
+
+    if backend == 'mongo':
+        persistent = MongoInsightStore(ttl)
+    elif backend == 'sqlite':
+        persistent = SQLiteInsightStore(
+            os.getenv('AI_CACHE_PATH', 'ai_cache.sqlite3'),
+            ttl,
+            max_entries=int(os.getenv('AI_CACHE_MAX_ENTRIES', '100000'))
+        )
+    else:
+        persistent = None
+
+    return AICache(memory_size, ttl, persistent)
@@ -2,10 +2,19 @@ import os
 import google.generativeai as genai
 from dotenv import load_dotenv
 
-from functools import wraps
 import time
+import inspect
 import concurrent.futures
-import hashlib
+import json
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+from ai_cache import cache_key, create_ai_cache
+from rate_limiter import RateLimiter, RateLimitTimeout, estimate_tokens
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from url_summary import summarize_urls
+import metrics
 
 # load the .env file
 load_dotenv()
@@ -13,57 +22,119 @@ load_dotenv()
 # setting up the gemini api key
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
-# Adding Circuit Breaker to the AI Processor
-class CircuitBreaker:
-    def __init__(self, max_failures=3, reset_timeout=60):
-        self.max_failures = max_failures
-        self.reset_timeout = reset_timeout
-        self.failures = 0
-        self.open_since = None
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            if self.open_since is not None:
-                if time.time() - self.open_since > self.reset_timeout:
-                    # Reset if timeout passed
-                    self.failures = 0
-                    self.open_since = None
-                else:
-                    raise Exception("Circuit Breaker: AI Service is temporarily Unavailable. Please try again later.")
-            try:
-                result = func(*args, **kwargs)
-                # Success, reset failure count
-                self.failures = 0
-                return result
-            except Exception as e:
-                self.failures += 1
-                if self.failures >= self.max_failures:
-                    self.open_since = time.time()
-                raise e
-        return wrapper
-    
+AI_MODEL_NAME = 'gemini-2.0-flash'
+
+# Stored in place of the insight when a company's analysis fails
+AI_ERROR_PREFIX = 'Error during analysis: '
+
+# One model client for the whole process, created on first use or by warm_up()
+_model = None
+_model_lock = threading.Lock()
+
+# Long-lived, bounded pool for Gemini calls so a timeout can return without
+# waiting for the request thread, and concurrent calls stay capped
+ai_max_concurrency = int(os.getenv('AI_MAX_CONCURRENCY', '8'))
+ai_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ai_max_concurrency,
+    thread_name_prefix='ai-request'
+)
+
+# Older client versions have no per-request options, they only get the executor timeout
+_supports_request_options = 'request_options' in inspect.signature(genai.GenerativeModel.generate_content).parameters
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = genai.GenerativeModel(AI_MODEL_NAME)
+    return _model
+
+def warm_up():
+    # Build the client and open its connection before the first job needs it
+    started = time.time()
+    try:
+        get_model()
+        genai.get_model(f"models/{AI_MODEL_NAME}")
+        print(f"AI client ready in {time.time() - started:.2f}s")
+        return True
+    except Exception as e:
+        print(f"AI client warm-up failed: {str(e)}")
+        return False
+
+def _reset_after_fork():
+    # The client's channel and the executor threads don't survive a fork
+    global _model, _model_lock, ai_executor
+    _model = None
+    _model_lock = threading.Lock()
+    ai_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ai_max_concurrency,
+        thread_name_prefix='ai-request'
+    )
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Circuit breaker per AI endpoint. Time spent queueing on our own rate limiter
+# says nothing about the service, it happens before the breaker sees a call.
+ai_breakers = CircuitBreakerRegistry(
+    failure_rate_threshold=float(os.getenv('AI_BREAKER_FAILURE_RATE', '0.5')),
+    minimum_calls=int(os.getenv('AI_BREAKER_MIN_CALLS', '3')),
+    window_seconds=int(os.getenv('AI_BREAKER_WINDOW', '60')),
+    reset_timeout=int(os.getenv('AI_BREAKER_RESET_TIMEOUT', '300')),
+    half_open_max_calls=int(os.getenv('AI_BREAKER_PROBES', '1')),
+    ignored_exceptions=(RateLimitTimeout,)
+)
+
 # Create AI Circuit Breaker
-ai_circuit_breaker = CircuitBreaker(max_failures=3, reset_timeout=300)
+ai_circuit_breaker = ai_breakers.get(AI_MODEL_NAME)
 
-# Cache for AI results to avoid duplicate processing
-ai_results_cache = {}
+def get_ai_breaker_stats():
+    return ai_breakers.snapshot()
 
-# Helper Function to Analyze Sitemap with AI
-def _do_analyze(company_name, sitemap_urls):
-    time.sleep(0.5)
-    
-    # Create a hash of the input to enable caching
-    input_hash = hashlib.md5(f"{company_name}:{','.join(sitemap_urls[:100])}".encode()).hexdigest()
-    
-    # Check if we have a cached result
-    if input_hash in ai_results_cache:
-        print(f"Using cached AI result for {company_name}")
-        return ai_results_cache[input_hash]
-        
-    sitemap_text = "\n".join(sitemap_urls)
+# Bump when the prompt or model changes so old insights are not reused
+PROMPT_VERSION = f"{AI_MODEL_NAME}:v2"
+
+# Insights keyed by sitemap content, in memory and on disk so every worker
+# process shares them and they survive a restart
+ai_results_cache = create_ai_cache()
 
-    prompt = f"""You are analyzing a company's online presence based on its sitemap. Below is a list of all the URLs found on the company's website:
+def get_ai_cache_stats():
+    return ai_results_cache.snapshot()
+
+# Shared limits for Gemini requests, across every worker thread in the process
+ai_rate_limiter = RateLimiter(
+    requests_per_minute=float(os.getenv('AI_REQUESTS_PER_MINUTE', '60')),
+    tokens_per_minute=float(os.getenv('AI_TOKENS_PER_MINUTE', '1000000'))
+)
+
+# How many times a rate-limited request is retried after backing off
+ai_rate_limit_retries = int(os.getenv('AI_RATE_LIMIT_RETRIES', '2'))
+
+# How long a request may wait for the rate limiter, on top of its own timeout
+ai_rate_limit_wait = float(os.getenv('AI_RATE_LIMIT_WAIT', '60'))
+
+def get_ai_rate_limiter_stats():
+    return ai_rate_limiter.snapshot()
+
+def _is_rate_limited(error):
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'rate limit' in message
+
+def _summary_lines(company_name, sitemap_urls):
+    # Collapse repeated sections and keep a representative sample within the prompt budget
+    summary = summarize_urls(sitemap_urls)
+    if summary.summarized:
+        print(f"Summarized {summary.total} sitemap URLs for {company_name} into "
+              f"{len(summary.sections)} sections and {len(summary.sample)} sample URLs")
+    return summary.lines()
+
+def _build_prompt(summary_lines):
+    sitemap_text = "\n".join(summary_lines)
+
+    return f"""You are analyzing a company's online presence based on its sitemap. Below are the URLs found on the company's website. Large sections are listed once as a path pattern with their page count, followed by a representative sample of pages:
                 {sitemap_text}
                 Based on this structure, generate a concise business insight about the company. Identify key focus areas, business priorities, and any indications of growth, investment, or technology adoption.
                 Format the response as:
@@ -71,39 +142,245 @@ def _do_analyze(company_name, sitemap_urls):
                 - Key Focus Areas:
                 - Potential Opportunities:
                 """
-    try:
-        # Initialize the Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        # Generate content using Gemini
-        response = model.generate_content(prompt)
-        # Extract and return the AI-generated insight
-        result = response.text
-        
-        # Cache the result
-        ai_results_cache[input_hash] = result
-        
-        return result
-    except Exception as e:
-        error_message = f"Error generating AI insights: {str(e)}"
-        print(error_message)
-        return f"Error: {error_message}. Please try again later."
 
-@ai_circuit_breaker
-def analyze_sitemap_with_ai(company_name, sitemap_urls, timeout=60):
-    # Limit number of URLs to prevent timeouts or quota issues
-    if len(sitemap_urls) > 100:
-        print(f"Limiting sitemap URLs for {company_name} from {len(sitemap_urls)} to 100")
-        sitemap_urls = sitemap_urls[:100]
-    
-    # Use timeout mechanism
+# Optional batching: small sitemaps from several companies share one request
+ai_batching = os.getenv('AI_BATCHING', '0') == '1'
+ai_batch_size = int(os.getenv('AI_BATCH_SIZE', '8'))
+ai_batch_max_urls = int(os.getenv('AI_BATCH_MAX_URLS', '20'))
+ai_batch_token_budget = int(os.getenv('AI_BATCH_TOKEN_BUDGET', '6000'))
+
+_batch_stats_lock = threading.Lock()
+ai_batch_stats = {'requests': 0, 'companies': 0, 'fallbacks': 0}
+
+def get_ai_batch_stats():
+    with _batch_stats_lock:
+        stats = dict(ai_batch_stats)
+    stats['enabled'] = ai_batching
+    stats['avg_companies_per_request'] = round(stats['companies'] / stats['requests'], 2) if stats['requests'] else 0.0
+    return stats
+
+def _count_batch(counter, amount=1):
+    with _batch_stats_lock:
+        ai_batch_stats[counter] += amount
+
+def is_batchable(url_count):
+    return url_count < ai_batch_max_urls
+
+def _request(prompt, timeout, mode):
+    # One Gemini call using the shared model, never longer than the timeout
+    request_kwargs = {}
+    if _supports_request_options:
+        request_kwargs['request_options'] = {'timeout': max(timeout, 1)}
+    with metrics.ai_request_seconds.labels(mode).time():
+        response = get_model().generate_content(prompt, **request_kwargs)
+    ai_rate_limiter.succeeded()
+    # Extract and return the AI-generated insight
+    return response.text
+
+def _generate(prompt, timeout, label, mode='single'):
+    # Gemini call behind the shared rate limiter and the circuit breaker,
+    # retried after backing off on a 429
+    prompt_tokens = estimate_tokens(prompt)
+
+    attempt = 0
+    while True:
+        # Wait our turn for the shared request and token budget. This happens
+        # before the breaker and the request timeout, our own queueing says
+        # nothing about the service.
+        if not ai_rate_limiter.acquire(prompt_tokens, timeout=ai_rate_limit_wait):
+            raise RateLimitTimeout(f"AI analysis for {label} timed out waiting for the rate limiter")
+        try:
+            return ai_circuit_breaker.call(_run_with_timeout, timeout, _request, prompt, timeout, mode)
+        except Exception as e:
+            if _is_rate_limited(e):
+                ai_rate_limiter.throttled()
+                if attempt < ai_rate_limit_retries:
+                    attempt += 1
+                    print(f"AI rate limited for {label}, retrying ({attempt}/{ai_rate_limit_retries})")
+                    continue
+            raise
+
+def _run_with_timeout(timeout, func, *args):
+    # Run on the shared AI executor, a hung request counts as a failure
+    future = ai_executor.submit(func, *args)
     try:
-        # Use a separate thread with timeout
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_do_analyze, company_name, sitemap_urls)
-            result = future.result(timeout=timeout)
-            return result
+        return future.result(timeout=timeout)
     except concurrent.futures.TimeoutError:
-        return f"AI analysis for {company_name} timed out. Analysis limited to prevent system overload."
+        future.cancel()
+        metrics.ai_timeouts.inc()
+        raise TimeoutError(f"AI request timed out after {timeout} seconds")
+
+# Helper Function to Analyze Sitemap with AI
+def _analyze_single(company_name, summary_lines, timeout):
+    # Identical summaries share a result, whatever company they belong to.
+    # Cache hits return straight away, even while the breaker is open.
+    input_hash = cache_key(summary_lines, PROMPT_VERSION)
+    cached = ai_results_cache.get(input_hash)
+    if cached is not None:
+        print(f"Using cached AI result for {company_name}")
+        return cached
+
+    # Errors propagate, the circuit breaker has seen them inside _generate
+    result = _generate(_build_prompt(summary_lines), timeout, company_name)
+
+    # Cache the result
+    ai_results_cache.put(input_hash, result)
+
+    return result
+
+def _analyze_or_error(company_name, summary_lines, timeout):
+    # One company's failure becomes its own error text, the rest of a batch is kept
+    try:
+        return _analyze_single(company_name, summary_lines, timeout)
     except Exception as e:
-        print(f"Error in AI analysis for {company_name}: {str(e)}")
-        return f"Error during analysis: {str(e)}"
\ No newline at end of file
+        print(f"AI analysis failed for {company_name}: {str(e)}")
+        return f"{AI_ERROR_PREFIX}{str(e)}"
+
+def analyze_sitemap_with_ai(company_name, sitemap_urls, timeout=60):
+    # Raises on failure, CircuitOpenError while the AI service is considered down
+    return _analyze_single(company_name, _summary_lines(company_name, sitemap_urls), timeout)
+
+def _build_batch_prompt(chunk):
+    sections = []
+    for number, (_, _, summary_lines, _) in enumerate(chunk, 1):
+        sitemap_text = "\n".join(summary_lines)
+        sections.append(f"=== Company {number} ===\n{sitemap_text}")
+    sections_text = "\n\n".join(sections)
+
+    return f"""You are analyzing the online presence of several companies based on their sitemaps. Each section below lists the URLs found on one company's website, with large parts of a site listed once as a path pattern and their page count:
+                {sections_text}
+                For each company separately, generate a concise business insight. Identify key focus areas, business priorities, and any indications of growth, investment, or technology adoption.
+                Format each insight as:
+                - Company Overview:
+                - Key Focus Areas:
+                - Potential Opportunities:
+                Respond with only a JSON array containing one object per company, in the same order as above:
+                [{{"company": <company number>, "insight": "<insight text>"}}]
+                """
+
+def _parse_batch_response(text, count):
+    # The model sometimes wraps JSON in a code fence
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`')
+        if text.startswith('json'):
+            text = text[4:]
+
+    entries = json.loads(text)
+    insights = {}
+    for entry in entries:
+        insights[int(entry['company'])] = str(entry['insight']).strip()
+
+    missing = [number for number in range(1, count + 1) if not insights.get(number)]
+    if missing:
+        raise ValueError(f"batch response is missing companies {missing}")
+    return [insights[number] for number in range(1, count + 1)]
+
+def _batch_chunks(pending):
+    # Split by company count and by the estimated prompt size
+    chunk = []
+    chunk_tokens = 0
+    for item in pending:
+        tokens = estimate_tokens("\n".join(item[2]))
+        if chunk and (len(chunk) >= ai_batch_size or chunk_tokens + tokens > ai_batch_token_budget):
+            yield chunk
+            chunk = []
+            chunk_tokens = 0
+        chunk.append(item)
+        chunk_tokens += tokens
+    if chunk:
+        yield chunk
+
+def analyze_sitemaps_batch(companies, timeout=60):
+    # companies is a list of (company_name, sitemap_urls), insights come back in the
+    # same order. A company whose analysis fails gets AI_ERROR_PREFIX error text.
+    results = [None] * len(companies)
+    pending = []
+    first_with_hash = {}  # input hash -> index of the first company that has it
+    duplicates = []
+
+    for index, (company_name, sitemap_urls) in enumerate(companies):
+        summary_lines = _summary_lines(company_name, sitemap_urls)
+        input_hash = cache_key(summary_lines, PROMPT_VERSION)
+        cached = ai_results_cache.get(input_hash)
+        if cached is not None:
+            print(f"Using cached AI result for {company_name}")
+            results[index] = cached
+            continue
+        if input_hash in first_with_hash:
+            # Same site listed twice, analyze it once
+            duplicates.append((index, first_with_hash[input_hash]))
+            continue
+        first_with_hash[input_hash] = index
+        if is_batchable(len(sitemap_urls)):
+            pending.append((index, company_name, summary_lines, input_hash))
+        else:
+            results[index] = _analyze_or_error(company_name, summary_lines, timeout)
+
+    for chunk in _batch_chunks(pending):
+        if len(chunk) == 1:
+            index, company_name, summary_lines, _ = chunk[0]
+            results[index] = _analyze_or_error(company_name, summary_lines, timeout)
+            continue
+
+        try:
+            text = _generate(_build_batch_prompt(chunk), timeout, f"{len(chunk)} companies", 'batch')
+            insights = _parse_batch_response(text, len(chunk))
+        except CircuitOpenError as e:
+            # AI service is down, later chunks fail fast the same way
+            print(f"Batched AI analysis skipped for {len(chunk)} companies: {str(e)}")
+            for index, _, _, _ in chunk:
+                results[index] = f"{AI_ERROR_PREFIX}{str(e)}"
+            continue
+        except Exception as e:
+            # Unparseable or failed batch, ask for each company on its own
+            print(f"Batched AI analysis failed for {len(chunk)} companies, falling back to single requests: {str(e)}")
+            _count_batch('fallbacks')
+            for index, company_name, summary_lines, _ in chunk:
+                results[index] = _analyze_or_error(company_name, summary_lines, timeout)
+            continue
+
+        _count_batch('requests')
+        _count_batch('companies', len(chunk))
+        for (index, _, _, input_hash), insight in zip(chunk, insights):
+            ai_results_cache.put(input_hash, insight)
+            results[index] = insight
+
+    for index, first in duplicates:
+        results[index] = results[first]
+    return results
+
+def _collect_metrics():
+    # AI cache, rate limiter, batching and breaker stats, exported when /metrics is scraped
+    cache = get_ai_cache_stats()
+    limiter = get_ai_rate_limiter_stats()
+    batching = get_ai_batch_stats()
+    breakers = get_ai_breaker_stats()
+
+    return [
+        ('ai_cache_lookups_total', 'counter', 'AI insight cache lookups by result',
+         [({'result': 'memory_hit'}, cache['memory_hits']),
+          ({'result': 'persistent_hit'}, cache['persistent_hits']),
+          ({'result': 'miss'}, cache['misses'])]),
+        ('ai_cache_entries', 'gauge', 'Entries in the in-memory AI cache tier',
+         [({}, cache['memory_entries'])]),
+        ('ai_rate_limit_throttled_total', 'counter', 'Rate limit or quota errors from the AI service',
+         [({}, limiter['throttled'])]),
+        ('ai_rate_limit_waiting', 'gauge', 'Callers queued on the AI rate limiter',
+         [({}, limiter['waiting'])]),
+        ('ai_rate_limit_wait_seconds_total', 'counter', 'Time callers spent waiting on the AI rate limiter',
+         [({}, limiter['wait_seconds'])]),
+        ('ai_rate_limit_fraction', 'gauge', 'Current fraction of the configured AI rate in use',
+         [({}, limiter['rate_fraction'])]),
+        ('ai_batch_requests_total', 'counter', 'Batched multi-company AI requests',
+         [({}, batching['requests'])]),
+        ('ai_batch_fallbacks_total', 'counter', 'Batched AI requests that fell back to single requests',
+         [({}, batching['fallbacks'])]),
+        ('ai_breaker_open', 'gauge', 'Whether the AI circuit breaker is open (1), half-open (0.5) or closed (0)',
+         [({'endpoint': name}, {'open': 1, 'half_open': 0.5}.get(stats['state'], 0))
+          for name, stats in breakers['endpoints'].items()]),
+        ('ai_breaker_trips_total', 'counter', 'Times an AI circuit breaker opened',
+         [({'endpoint': name}, stats['opened']) for name, stats in breakers['endpoints'].items()]),
+    ]
+
+metrics.register_collector(_collect_metrics)
@@ -1,17 +1,23 @@
 import os
-import pandas as pd
-from flask import Flask, request, send_file, render_template, redirect, url_for, jsonify
-from io import BytesIO
+from flask import Flask, request, send_file, render_template, redirect, url_for, jsonify, Response, stream_with_context
 import time
 from dotenv import load_dotenv
-from scraper import extract_sitemap
-from ai_processor import analyze_sitemap_with_ai
-from database import init_db, store_company_data, get_company_data, reset_database
+from scraper import get_host_breaker_stats
+from ai_processor import get_ai_cache_stats, get_ai_rate_limiter_stats, get_ai_batch_stats, get_ai_breaker_stats, ai_circuit_breaker
+import health
+import metrics
+from database import init_db, get_company_data, reset_database, iter_company_documents
+from job_store import create_job_store, QueueFull
+from pipeline import Pipeline, pipeline_config_from_env
+from url_utils import normalize_host
+import export
 
 import threading
-import queue
+import multiprocessing
 import uuid
 import json
+import csv
+import io
 
 # Load environment variables
 load_dotenv()
@@ -22,70 +28,67 @@ app = Flask(__name__)
 # Initialize database connection
 init_db()
 
-# ADD JOB QUEUE AND RESULTS DICTIONARY
-job_queue = queue.Queue()
-results = {}
+# Durable job queue and results store, shared by every worker process
+job_store = create_job_store()
 
-def worker():
+# How long to wait for room in a full queue before rejecting an upload.
+# An upload is admitted as a whole, once there is room for all of its rows.
+enqueue_timeout = float(os.getenv('JOB_ENQUEUE_TIMEOUT', '5'))
+
+# How often the event stream checks the job store for finished jobs
+sse_poll_interval = float(os.getenv('SSE_POLL_INTERVAL', '1'))
+
+# Rows from an upload are written to the job store in chunks of this size
+enqueue_chunk_size = int(os.getenv('JOB_ENQUEUE_CHUNK_SIZE', '500'))
+
+def janitor(interval=60):
+    # Expire old results and requeue jobs whose worker went away
     while True:
-        job_id, company_name, website_url = job_queue.get()
         try:
-            result = process_company(company_name, website_url)
-            results[job_id] = {"status": "complete", "data": result}
+            purged = job_store.purge_expired()
+            requeued = job_store.requeue_stale()
+            if purged or requeued:
+                print(f"Job store maintenance: {purged} expired, {requeued} requeued")
         except Exception as e:
-            print(f"Worker error processing {company_name}: {str(e)}")
-            results[job_id] = {"status": "error", "message": str(e)}
-        finally:
-            job_queue.task_done()
-
-# Start worker thread
-worker_count = 5
-for _ in range(worker_count):
-    t = threading.Thread(target=worker, daemon=True)
-    t.start()
-
-def process_company(company_name, website_url):
-    
-    # Scrape the sitemap
-    sitemap_urls = extract_sitemap(website_url)
-    
-    # Generate AI insights
-    insights = analyze_sitemap_with_ai(company_name, sitemap_urls)
-    
-    # Store in database
-    company_data = {
-        'company_name': company_name,
-        'website_url': website_url,
-        'sitemap_urls': sitemap_urls,
-        'ai_insights': insights,
-        'last_updated': time.time()
-    }
-    
-    # Store in database
-    store_company_data(company_data)
-    
-    return {
-        'Company': company_name,
-        'Website': website_url,
-        'Sitemap Complete': ", ".join(sitemap_urls),
-        'Insight from Prompt': insights
-    }
+            print(f"Job store maintenance error: {str(e)}")
+        time.sleep(interval)
 
-def process_csv(csv_file, async_mode=True):
-    # Read CSV in Chunks to avoid loading everything into memory
-    chunk_size = 10
-    output_data = []
-    job_ids = []
-    
-    # Keep track of unique companies to avoid duplicates
-    unique_companies = set()
+# Scrape worker processes re-import this module when the app runs as a script,
+# only the parent process starts background threads
+is_main_process = multiprocessing.parent_process() is None
+
+# Start the scrape -> AI -> store pipeline, unless workers run separately (worker.py)
+pipeline = None
+if os.getenv('RUN_WORKERS', '1') == '1' and is_main_process:
+    pipeline = Pipeline(job_store, **pipeline_config_from_env())
+    pipeline.start()
+
+if is_main_process:
+    threading.Thread(target=janitor, daemon=True).start()
 
-    # Find column names first by reading just the header
-    header_df = pd.read_csv(csv_file, nrows=0)
+# Dependency checks run in the background, the health endpoints read the cached result.
+# The AI status comes from the circuit breaker, never from a test generation.
+health_monitor = health.HealthMonitor(interval=float(os.getenv('HEALTH_CHECK_INTERVAL', '15')))
+health_monitor.add_check('mongo', health.mongo_check)
+health_monitor.add_check('job_store', lambda: health.job_store_check(job_store))
+health_monitor.add_check('ai_service', lambda: health.breaker_check(ai_circuit_breaker), critical=False)
+if pipeline is not None:
+    health_monitor.add_check('pipeline', lambda: health.pipeline_check(pipeline))
+if is_main_process:
+    health_monitor.start()
+
+def collect_job_metrics():
+    counts = job_store.counts()
+    return [('jobs', 'gauge', 'Jobs in the job store by status',
+             [({'status': status}, counts.get(status, 0)) for status in ('queued', 'processing', 'complete', 'error')])]
+
+metrics.register_collector(collect_job_metrics)
+
+def find_csv_columns(columns):
     company_col = None
     website_col = None
 
-    for col in header_df.columns:
+    for col in columns:
         if col.lower() == 'company':
             company_col = col
         elif col.lower() == 'website':
@@ -93,30 +96,79 @@ def process_csv(csv_file, async_mode=True):
     
     # if we cannot find exact matches, look for similar columns
     if not company_col:
-        for col in header_df.columns:
+        for col in columns:
             if 'company' in col.lower() or'name' in col.lower() or 'organization' in col.lower():
                 company_col = col
                 break
 
     if not website_col:
-        for col in header_df.columns:
+        for col in columns:
             if 'website' in col.lower() or 'url' in col.lower() or 'site' in col.lower():
                 website_col = col
                 break
     
     if not company_col or not website_col:
-        error_msg = f"Could not find required columns. Your CSV has these columns: {list(header_df.columns)}"
+        error_msg = f"Could not find required columns. Your CSV has these columns: {list(columns)}"
         print(error_msg)
         raise ValueError(error_msg)
-    
-    # Reset file position
+
+    return company_col, website_col
+
+# Raised when an upload stops part way, the jobs queued before it still run
+class UploadInterrupted(Exception):
+    def __init__(self, error, queued):
+        super().__init__(str(error))
+        self.error = error
+        self.queued = queued
+
+# Raised when an upload has more rows than the job queue can ever hold
+class UploadTooLarge(Exception):
+    pass
+
+def count_csv_rows(csv_file):
+    # Upper bound on the data rows of a seekable upload, from a fast newline count.
+    # Quoted newlines, blank and repeated rows can only make it overcount.
+    lines = 0
+    last = b''
+    for block in iter(lambda: csv_file.read(1 << 20), b''):
+        lines += block.count(b'\n')
+        last = block
+    if last and not last.endswith(b'\n'):
+        lines += 1
     csv_file.seek(0)
+    return max(lines - 1, 0)
+
+def process_csv(csv_file, batch_id, incremental=False):
+    # Stream the upload row by row and enqueue jobs in chunks as we go,
+    # so memory stays flat no matter how many rows the file has
+    queued = 0
+    pending = []
+
+    try:
+        # Admit the upload as a whole against the queue capacity, before any
+        # of it is queued: too big is rejected outright, no room yet waits and
+        # then gives up. Once admitted the chunks below skip the check.
+        rows = count_csv_rows(csv_file)
+        if rows > job_store.capacity:
+            raise UploadTooLarge(f"Upload has {rows} rows, the job queue holds at most {job_store.capacity}")
+        job_store.wait_for_room(rows, enqueue_timeout)
+
+        reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8-sig', errors='replace', newline=''))
+
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("The uploaded CSV file is empty")
+        header = [col.strip() for col in header]
+        company_col, website_col = find_csv_columns(header)
+        company_idx = header.index(company_col)
+        website_idx = header.index(website_col)
 
-    # Chunk processing
-    for chunk in pd.read_csv(csv_file, chunksize=chunk_size):
-        for _, row in chunk.iterrows():
-            company_name = row[company_col].strip() if isinstance(row[company_col], str) else str(row[company_col])
-            website_url = row[website_col].strip() if isinstance(row[website_col], str) else str(row[website_col])
+        for row in reader:
+            if len(row) <= max(company_idx, website_idx):
+                continue
+
+            company_name = row[company_idx].strip()
+            website_url = row[website_idx].strip()
             
             # Check for empty values
             if not company_name or not website_url:
@@ -126,114 +178,187 @@ def process_csv(csv_file, async_mode=True):
             if not website_url.startswith(('http://', 'https://')):
                 website_url = 'https://' + website_url
                 
-            # Create a unique key for deduplication
-            unique_key = f"{company_name.lower()}:{website_url.lower()}"
-            
-            # Skip if we've already processed this company+website combination
-            if unique_key in unique_companies:
-                continue
-                
-            unique_companies.add(unique_key)
-
-            if async_mode:
-                # Queue for async processing
-                job_id = f"job_{uuid.uuid4()}"
-                job_queue.put((job_id, company_name, website_url))
-                job_ids.append(job_id)
-
-                output_data.append({
-                    'Company': company_name,
-                    'Website': website_url,
-                    'Processing': 'Queued for processing',
-                    'Job ID': job_id
-                })
+            # Create a unique key for deduplication, the job store skips repeats within a batch.
+            # Listings of the same site (http/https, www., paths) count as one.
+            unique_key = f"{company_name.lower()}:{normalize_host(website_url)}"
+
+            job_id = f"job_{uuid.uuid4()}"
+            job_payload = {'company_name': company_name, 'website_url': website_url}
+            if incremental:
+                job_payload['incremental'] = True
+            pending.append((job_id, job_payload, unique_key))
+
+            if len(pending) >= enqueue_chunk_size:
+                queued += job_store.enqueue_many(batch_id, pending, timeout=None)
+                pending = []
+
+        if pending:
+            queued += job_store.enqueue_many(batch_id, pending, timeout=None)
+    except Exception as e:
+        raise UploadInterrupted(e, queued) from e
     
-    return output_data, job_ids
+    return queued
 
 # Flask routes
 
 # Routes for async processing
 @app.route('/status')
 def all_jobs_status():
-    return jsonify(results)
+    # Defaults to the most recent upload
+    batch_id = request.args.get('batch') or job_store.latest_batch()
+    if not batch_id:
+        return jsonify({})
+    return jsonify(job_store.batch_results(batch_id))
 
 @app.route('/status/<job_id>')
 def job_status(job_id):
-    if job_id in results:
-        return jsonify(results[job_id])
+    result = job_store.get(job_id)
+    if result is not None:
+        return jsonify(result)
     else:
         return jsonify({"status": "not found"})
     
+@app.route('/batches/<batch_id>/progress')
+def batch_progress(batch_id):
+    # Counts for the batch plus only the jobs that finished after the cursor
+    cursor = request.args.get('cursor', 0, type=int)
+    progress = job_store.batch_progress(batch_id, cursor)
+    if progress is None:
+        return jsonify({"error": "batch not found"}), 404
+    return jsonify(progress)
+
+@app.route('/batches/<batch_id>/events')
+def batch_events(batch_id):
+    # Server-Sent Events: a 'job' event per finished job, 'progress' with the
+    # counts after each change and 'done' once the whole batch has finished
+    cursor = request.headers.get('Last-Event-ID', type=int) or request.args.get('cursor', 0, type=int)
+
+    def stream(cursor):
+        first = True
+        idle_since = time.time()
+        while True:
+            progress = job_store.batch_progress(batch_id, cursor)
+            if progress is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'batch not found'})}\n\n"
+                return
+
+            for job in progress['jobs']:
+                yield f"event: job\ndata: {json.dumps(job)}\n\n"
+
+            if progress['jobs'] or first:
+                counts = {key: value for key, value in progress.items() if key != 'jobs'}
+                yield f"id: {progress['cursor']}\nevent: progress\ndata: {json.dumps(counts)}\n\n"
+                idle_since = time.time()
+            first = False
+            cursor = progress['cursor']
+
+            if progress['done'] and not progress['jobs']:
+                yield "event: done\ndata: {}\n\n"
+                return
+
+            if not progress['jobs']:
+                # Comment line keeps proxies from closing an idle stream
+                if time.time() - idle_since >= 15:
+                    yield ": keep-alive\n\n"
+                    idle_since = time.time()
+                time.sleep(sse_poll_interval)
+
+    return Response(
+        stream_with_context(stream(cursor)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/results')
 def get_results():
-    # Check if all jobs are complete
-    completed_results = []
-    
-    # Create a dictionary to deduplicate results by company name
-    company_results = {}
-    
-    for job_id, result in results.items():
-        if result['status'] == 'complete' and 'data' in result:
-            # Use company_name as unique key
-            company_name = result['data']['Company']
-            
-            # If company already exists with older data, update it
-            if company_name in company_results:
-                # Keep the most recent result (assumes job_id is roughly chronological)
-                # In a more robust system, you might want to compare timestamps
-                company_results[company_name] = result['data']
-            else:
-                company_results[company_name] = result['data']
-    
-    # Convert dictionary values to list
-    completed_results = list(company_results.values())
-    
-    # Create output CSV
-    output_df = pd.DataFrame(completed_results)
-
-    # Save to BytesIO
-    output_csv = BytesIO()
-    output_df.to_csv(output_csv, index=False)
-    output_csv.seek(0)
-
-    # Create in-memory file for download
-    return send_file(
-        output_csv,
-        mimetype='text/csv',
-        download_name='sitemap_analysis_results.csv',
-        as_attachment=True
+    # Results are streamed straight from the job store (or the companies
+    # collection with ?source=db), nothing is materialized in memory
+    output_format = request.args.get('format', 'csv')
+    source = request.args.get('source', 'jobs')
+
+    if output_format not in ('csv', 'parquet', 'arrow'):
+        return jsonify({"error": f"Unsupported format: {output_format}"}), 400
+    if output_format != 'csv' and not export.columnar_available():
+        return jsonify({"error": "Parquet and Arrow exports need pyarrow installed"}), 501
+
+    if source == 'db':
+        rows = export.document_rows(iter_company_documents())
+    else:
+        batch_id = request.args.get('batch') or job_store.latest_batch()
+        results = job_store.iter_completed_results(batch_id) if batch_id else iter(())
+        rows = export.result_rows(results)
+
+    if output_format == 'parquet':
+        return send_file(
+            export.write_parquet(rows),
+            mimetype='application/vnd.apache.parquet',
+            download_name='sitemap_analysis_results.parquet',
+            as_attachment=True
+        )
+
+    if output_format == 'arrow':
+        body = export.arrow_stream(rows)
+        mimetype = 'application/vnd.apache.arrow.stream'
+        filename = 'sitemap_analysis_results.arrows'
+    else:
+        body = export.csv_stream(rows)
+        mimetype = 'text/csv'
+        filename = 'sitemap_analysis_results.csv'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health/live')
+def liveness():
+    # The process is up and serving requests, nothing else is checked
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready')
+def readiness():
+    # Cached dependency status, 503 while a critical dependency is down
+    status = health_monitor.snapshot()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/health')
 def health_check():
-    # Check MongoDB Connection
-    try:
-        from database import db
-        db.command('ping')
-        mongo_status = 'OK'
-    except Exception as e:
-        mongo_status = f"error: {str(e)}"
-    
-    # Check AI Service
-    try:
-        import google.generativeai as genai
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        model = genai.get_model('gemini-2.0-flash')
-        model.generate_content("test")
-        ai_status = 'OK'
-    except Exception as e:
-        ai_status = f"error: {str(e)}"
+    # Cached checks in the format the frontend expects ('OK' or an error message)
+    mongo = health_monitor.result('mongo')
+    ai = health_monitor.result('ai_service')
+    mongo_status = mongo['detail'] if mongo is not None else 'checking'
+    ai_status = 'checking' if ai is None else ('OK' if ai['status'] != health.DOWN else ai['detail'])
     
-    # Check worker queue
-    queue_status = {
-        'queue_size': job_queue.qsize(),
-        'results_size': len(results)
-    }
+    # Worker queue, from the last job store check
+    jobs = health_monitor.result('job_store')
+    if jobs is not None and isinstance(jobs['detail'], dict):
+        queue_status = {
+            'queue_size': jobs['detail']['queued'],
+            'results_size': jobs['detail']['complete'] + jobs['detail']['error']
+        }
+    else:
+        queue_status = 'checking' if jobs is None else jobs['detail']
     status = {
         'app':'running',
         'mongo': mongo_status,
         'ai_service': ai_status,
-        'job_queue': queue_status
+        'job_queue': queue_status,
+        'checks': health_monitor.snapshot()
+    }
+    if pipeline is not None:
+        status['pipeline'] = pipeline.stats()
+    status['ai_cache'] = get_ai_cache_stats()
+    status['ai_rate_limiter'] = get_ai_rate_limiter_stats()
+    status['ai_batching'] = get_ai_batch_stats()
+    status['circuit_breakers'] = {
+        'ai': get_ai_breaker_stats(),
+        'hosts': get_host_breaker_stats()
     }
 
     return jsonify(status)
@@ -253,21 +378,42 @@ def upload_file():
         return jsonify({"error": "No selected file"}), 400
     
     if file and file.filename.endswith('.csv'):
+        # Incremental uploads keep the stored companies and only redo what changed
+        incremental = request.form.get('incremental', os.getenv('INCREMENTAL_MODE', '0')).lower() in ('1', 'true', 'on')
+
         try:
             # Clear the Database
-            reset_database()
+            if not incremental:
+                reset_database()
 
-            # Clear any existing results
-            results.clear()
+            # Jobs from this upload share a batch ID, older batches expire on their own
+            batch_id = f"batch_{uuid.uuid4()}"
 
-            # Process the CSV and get job IDs
-            output_data, job_ids = process_csv(file, async_mode=True)
+            # Stream the CSV into the job queue
+            try:
+                queued = process_csv(file.stream, batch_id, incremental)
+            except UploadInterrupted as e:
+                # Whatever was queued keeps running under this batch ID
+                if isinstance(e.error, UploadTooLarge):
+                    status = 413
+                elif isinstance(e.error, QueueFull):
+                    status = 429
+                else:
+                    status = 500
+                return jsonify({
+                    "error": str(e),
+                    "batch_id": batch_id,
+                    "accepted": e.queued
+                }), status
             
-            # Return job IDs as JSON
+            # Return the batch ID as JSON, progress is tracked per batch
             return jsonify({
                 "status": "processing",
-                "job_ids": job_ids,
-                "message": f"Processing {len(job_ids)} companies"
+                "batch_id": batch_id,
+                "total": queued,
+                "accepted": queued,
+                "incremental": incremental,
+                "message": f"Processing {queued} companies"
             })
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -0,0 +1,100 @@
+import threading
+
+# In-memory replacement for the parts of a pymongo collection the app uses,
+# so the benchmarks run without a MongoDB server.
+class FakeResult:
+    def __init__(self, upserted_count=0, modified_count=0, deleted_count=0):
+        self.upserted_count = upserted_count
+        self.modified_count = modified_count
+        self.deleted_count = deleted_count
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction=1):
+        self.documents.sort(key=lambda document: document.get(key) or 0, reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    def _key(self, filter):
+        return tuple(sorted(filter.items()))
+
+    def create_index(self, *args, **kwargs):
+        return 'index'
+
+    def update_one(self, filter, update, upsert=False):
+        with self._lock:
+            key = self._key(filter)
+            exists = key in self.documents
+            if exists or upsert:
+                document = self.documents.setdefault(key, dict(filter))
+                document.update(update.get('$set', {}))
+                for field in update.get('$unset', {}):
+                    document.pop(field, None)
+            return FakeResult(upserted_count=int(upsert and not exists), modified_count=int(exists))
+
+    def replace_one(self, filter, document, upsert=False):
+        with self._lock:
+            self.documents[self._key(filter)] = dict(document)
+        return FakeResult(modified_count=1)
+
+    def bulk_write(self, operations, ordered=True):
+        upserted = modified = 0
+        for operation in operations:
+            result = self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+            upserted += result.upserted_count
+            modified += result.modified_count
+        return FakeResult(upserted_count=upserted, modified_count=modified)
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        documents = self.find(filter, projection).documents
+        for key, direction in sort or ():
+            documents.sort(key=lambda document: document.get(key) or 0, reverse=direction < 0)
+        return documents[0] if documents else None
+
+    def find(self, filter=None, projection=None):
+        with self._lock:
+            documents = [dict(document) for document in self.documents.values()
+                         if all(document.get(k) == v for k, v in (filter or {}).items())]
+        return FakeCursor(documents)
+
+    def delete_many(self, filter):
+        with self._lock:
+            deleted = len(self.documents)
+            self.documents.clear()
+        return FakeResult(deleted_count=deleted)
+
+    def aggregate(self, pipeline):
+        return []
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def command(self, name):
+        return {'ok': 1}
+
+def install():
+    # Call before app is imported, init_db() then binds the fake collections
+    import database
+
+    def init_db():
+        database.db = FakeDatabase()
+        database.company_collection = database.db['companies']
+
+    database.init_db = init_db
+    return database
@@ -0,0 +1,53 @@
+import json
+import random
+import re
+import threading
+import time
+
+import google.generativeai as genai
+
+# Stand-in for genai.GenerativeModel with a configurable latency and error rate.
+# Batched prompts get a JSON answer so the batching path can be measured too.
+class StubModel:
+    latency = 0.2
+    failure_rate = 0.0
+    calls = 0
+    _lock = threading.Lock()
+    _random = random.Random(0)
+
+    def __init__(self, model_name, *args, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, **kwargs):
+        with StubModel._lock:
+            StubModel.calls += 1
+            fail = StubModel._random.random() < StubModel.failure_rate
+        time.sleep(StubModel.latency)
+        if fail:
+            raise RuntimeError('stub model failure')
+
+        companies = len(re.findall(r'=== Company \d+ ===', prompt))
+        if companies:
+            return StubResponse(json.dumps([
+                {'company': number, 'insight': _insight(f'company {number}')}
+                for number in range(1, companies + 1)
+            ]))
+        return StubResponse(_insight('the company'))
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+def _insight(subject):
+    return (f"- Company Overview: Synthetic overview of {subject}.\n"
+            "- Key Focus Areas: Benchmarking.\n"
+            "- Potential Opportunities: None, this is a stub.")
+
+def install(latency=0.2, failure_rate=0.0):
+    # Call before ai_processor is imported
+    StubModel.latency = latency
+    StubModel.failure_rate = failure_rate
+    StubModel.calls = 0
+    genai.GenerativeModel = StubModel
+    genai.get_model = lambda name: {'name': name}
+    return StubModel
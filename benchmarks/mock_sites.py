@@ -0,0 +1,125 @@
+import gzip
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Synthetic websites for the benchmarks, each on its own port so every site is
+# a separate host for the scraper's per-host limits and circuit breakers.
+#   index   robots.txt -> sitemap index -> 3 child urlsets
+#   plain   /sitemap.xml urlset
+#   gzip    /sitemap.xml served gzip-compressed
+#   html    no sitemap, links on the home page
+#   slow    like plain, every response is delayed
+#   failing every request returns 500
+#   dead    nothing listening on the port
+SITE_KINDS = ['index', 'plain', 'gzip', 'html', 'slow', 'failing', 'dead']
+
+def urlset(base, prefix, count):
+    entries = ''.join(
+        f'<url><loc>{base}/{prefix}/page-{i}</loc><lastmod>2024-01-{i % 28 + 1:02d}</lastmod></url>'
+        for i in range(count)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f'{entries}</urlset>').encode()
+
+def sitemap_index(base, children):
+    entries = ''.join(f'<sitemap><loc>{base}{child}</loc></sitemap>' for child in children)
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f'{entries}</sitemapindex>').encode()
+
+def html_page(base, count):
+    links = ''.join(f'<a href="/section/page-{i}">Page {i}</a>' for i in range(count))
+    return f'<html><body><a href="#top">top</a>{links}<a href="https://elsewhere.example/">out</a></body></html>'.encode()
+
+class SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        site = self.server
+        site.requests += 1
+        if site.delay:
+            time.sleep(site.delay)
+
+        status, content_type, body = self.route(site)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, site):
+        base = site.base_url
+        path = self.path.split('?', 1)[0]
+
+        if site.kind == 'failing':
+            return 500, 'text/plain', b'internal error'
+
+        if site.kind == 'index':
+            if path == '/robots.txt':
+                return 200, 'text/plain', f'User-agent: *\nSitemap: {base}/sitemap_index.xml\n'.encode()
+            if path == '/sitemap_index.xml':
+                return 200, 'application/xml', sitemap_index(base, [f'/sitemaps/part-{i}.xml' for i in range(3)])
+            if path.startswith('/sitemaps/part-'):
+                part = path.rsplit('-', 1)[1].split('.')[0]
+                return 200, 'application/xml', urlset(base, f'part-{part}', site.pages // 3)
+
+        if site.kind in ('plain', 'slow') and path == '/sitemap.xml':
+            return 200, 'application/xml', urlset(base, 'pages', site.pages)
+
+        if site.kind == 'gzip' and path == '/sitemap.xml':
+            return 200, 'application/x-gzip', gzip.compress(urlset(base, 'pages', site.pages))
+
+        if site.kind == 'html' and path == '/':
+            return 200, 'text/html', html_page(base, min(site.pages, 150))
+
+        return 404, 'text/plain', b'not found'
+
+class SiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, kind, pages=300, delay=0.0):
+        super().__init__(('127.0.0.1', 0), SiteHandler)
+        self.kind = kind
+        self.pages = pages
+        self.delay = delay
+        self.requests = 0
+        self.base_url = f'http://127.0.0.1:{self.server_port}'
+
+def closed_port_url():
+    # Bind and release a port so nothing is listening on it
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f'http://127.0.0.1:{port}'
+
+def start_site(kind, pages=300, delay=0.0):
+    if kind == 'dead':
+        return closed_port_url(), None
+    if kind == 'slow' and not delay:
+        delay = 1.0
+    server = SiteServer(kind, pages, delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.base_url, server
+
+def start_sites(count, kinds=None, pages=300, slow_delay=1.0):
+    # count sites, cycling through the given kinds
+    kinds = kinds or SITE_KINDS
+    sites = []
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        url, server = start_site(kind, pages, slow_delay if kind == 'slow' else 0.0)
+        sites.append({'kind': kind, 'url': url, 'server': server})
+    return sites
+
+def stop_sites(sites):
+    for site in sites:
+        if site['server'] is not None:
+            site['server'].shutdown()
+            site['server'].server_close()
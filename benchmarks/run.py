@@ -0,0 +1,228 @@
+import argparse
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline benchmarks: local mock websites, a stub Gemini model and an
+# in-memory MongoDB stand-in. Run from the repository root:
+#   python benchmarks/run.py --scenario all --sites 28 --companies 200
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+def configure_environment(work_dir):
+    # Everything the app would keep on disk goes to a throwaway directory, and
+    # the AI limits are lifted so the stub's latency is what gets measured
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ.setdefault('MONGO_URI', 'mongodb://127.0.0.1:1')
+    os.environ.setdefault('HTTP_CACHE_ENABLED', '0')
+    os.environ.setdefault('AI_CACHE_BACKEND', 'none')
+    os.environ.setdefault('AI_REQUESTS_PER_MINUTE', '1000000')
+    os.environ.setdefault('AI_TOKENS_PER_MINUTE', '1000000000')
+    os.environ.setdefault('AI_WARM_UP', '0')
+    os.environ['JOB_DB_PATH'] = os.path.join(work_dir, 'jobs.sqlite3')
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def report(name, latencies, seconds, peak_bytes, errors=0, extra=None):
+    result = {
+        'scenario': name,
+        'operations': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_per_second': round(len(latencies) / seconds, 2) if seconds else 0.0,
+        'p50_seconds': round(percentile(latencies, 0.5), 4),
+        'p99_seconds': round(percentile(latencies, 0.99), 4),
+        'peak_memory_mb': round(peak_bytes / (1024 * 1024), 2),
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+def measure(func, items, concurrency):
+    # Run func over items on a thread pool, timing every call and tracking peak memory
+    latencies = []
+    errors = 0
+
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            func(item)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, e
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, error in executor.map(timed, items):
+            latencies.append(latency)
+            if error is not None:
+                errors += 1
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return latencies, seconds, peak, errors
+
+def bench_extract(args, sites):
+    import scraper
+
+    found = {}
+
+    def extract(site):
+        found[site['url']] = len(scraper.extract_sitemap(site['url'], args.extract_budget))
+
+    latencies, seconds, peak, errors = measure(extract, sites, args.concurrency)
+    by_kind = {}
+    for site in sites:
+        by_kind.setdefault(site['kind'], []).append(found.get(site['url'], 0))
+    return report('extract_sitemap', latencies, seconds, peak, errors, {
+        'urls_by_kind': {kind: sum(counts) for kind, counts in by_kind.items()},
+        'connections': {key: value for key, value in scraper.get_connection_stats().items() if key != 'hosts'},
+    })
+
+def bench_ai(args):
+    import ai_processor
+
+    companies = [
+        (f'Company {i}', [f'https://company-{i}.example/page-{j}' for j in range(args.urls_per_company)])
+        for i in range(args.companies)
+    ]
+
+    latencies, seconds, peak, errors = measure(
+        lambda company: ai_processor.analyze_sitemap_with_ai(*company), companies, args.concurrency
+    )
+    return report('analyze_sitemap_with_ai', latencies, seconds, peak, errors, {
+        'stub_latency_seconds': args.ai_latency,
+        'cache': ai_processor.get_ai_cache_stats(),
+    })
+
+def foreign_urls(rows, site_by_company):
+    # URLs in each result row that don't belong to that company's own mock site
+    foreign = {}
+    for row in rows:
+        base = site_by_company[row['Company']]
+        urls = row['Sitemap URLs']
+        wrong = [url for url in urls if url != base and not url.startswith(base + '/')]
+        if wrong:
+            foreign[row['Company']] = wrong
+    return foreign
+
+def bench_end_to_end(args, sites):
+    import app
+
+    client = app.app.test_client()
+    rows = ['Company,Website']
+    site_by_company = {}
+    for i in range(args.companies):
+        site_by_company[f'Company {i}'] = sites[i % len(sites)]['url']
+        rows.append(f"Company {i},{sites[i % len(sites)]['url']}/?company={i}")
+    upload = ('\n'.join(rows) + '\n').encode()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    response = client.post('/process', data={'file': (io.BytesIO(upload), 'companies.csv')},
+                           content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f"/process failed: {response.status_code} {response.get_data(as_text=True)}")
+    batch_id = response.json['batch_id']
+    submitted = time.perf_counter()
+
+    # Time from upload to each job's result, at the resolution of the polling interval
+    job_latencies = []
+    cursor = 0
+    deadline = time.time() + args.e2e_timeout
+    while time.time() < deadline:
+        progress = client.get(f'/batches/{batch_id}/progress?cursor={cursor}').json
+        now = time.perf_counter()
+        job_latencies.extend(now - started for _ in progress['jobs'])
+        cursor = progress['cursor']
+        if progress['done']:
+            break
+        time.sleep(args.poll_interval)
+    else:
+        raise RuntimeError(f"batch did not finish within {args.e2e_timeout} seconds")
+
+    status = client.get(f'/status?batch={batch_id}').json
+    results = client.get(f'/results?batch={batch_id}')
+    result_rows = list(csv.DictReader(io.StringIO(results.get_data(as_text=True))))
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Throughput means nothing if companies got another site's URLs
+    foreign = foreign_urls((job['data'] for job in status.values() if job['status'] == 'complete'), site_by_company)
+    if foreign:
+        company, urls = next(iter(foreign.items()))
+        raise RuntimeError(f"{len(foreign)} companies have URLs from other sites, e.g. {company}: {urls[:3]}")
+
+    errors = sum(1 for job in status.values() if job['status'] == 'error')
+    return report('process_to_results', job_latencies, seconds, peak, errors, {
+        'upload_seconds': round(submitted - started, 3),
+        'result_rows': len(result_rows),
+        'pipeline': app.pipeline.stats() if app.pipeline is not None else None,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmarks for the sitemap analyzer.')
+    parser.add_argument('--scenario', choices=['extract', 'ai', 'e2e', 'all'], default='all')
+    parser.add_argument('--sites', type=int, default=28, help='mock websites, cycling through every site kind')
+    parser.add_argument('--kinds', default=None, help='comma separated site kinds (default: all)')
+    parser.add_argument('--pages', type=int, default=300, help='URLs per mock sitemap')
+    parser.add_argument('--slow-delay', type=float, default=1.0, help='per-response delay of slow sites')
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--urls-per-company', type=int, default=50)
+    parser.add_argument('--ai-latency', type=float, default=0.2, help='stub Gemini latency in seconds')
+    parser.add_argument('--ai-failure-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--extract-budget', type=float, default=20)
+    parser.add_argument('--e2e-timeout', type=float, default=600)
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--output', default=None, help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='sitemap-bench-')
+    configure_environment(work_dir)
+
+    # The stubs have to be in place before the app modules import them
+    import mock_genai
+    import fake_mongo
+    import mock_sites
+    mock_genai.install(args.ai_latency, args.ai_failure_rate)
+    fake_mongo.install()
+
+    kinds = args.kinds.split(',') if args.kinds else None
+    sites = mock_sites.start_sites(args.sites, kinds, args.pages, args.slow_delay)
+
+    results = []
+    try:
+        if args.scenario in ('extract', 'all'):
+            results.append(bench_extract(args, sites))
+        if args.scenario in ('ai', 'all'):
+            results.append(bench_ai(args))
+        if args.scenario in ('e2e', 'all'):
+            results.append(bench_end_to_end(args, sites))
+    finally:
+        mock_sites.stop_sites(sites)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import collections
+import threading
+import time
+from functools import wraps
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    pass
+
+# Closed -> open when the failure rate over the sliding window crosses the
+# threshold. After reset_timeout it goes half-open and lets a few probe calls
+# through: a successful probe closes it again, a failed one reopens it.
+class CircuitBreaker:
+    def __init__(self, name, failure_rate_threshold=0.5, minimum_calls=5, window_seconds=60,
+                 reset_timeout=60, half_open_max_calls=1, ignored_exceptions=()):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.ignored_exceptions = ignored_exceptions
+
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = collections.deque()  # (timestamp, failed)
+        self._failures = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self.last_success_at = None
+        self.last_failure_at = None
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._probes = 0
+        self._outcomes.clear()
+        self._failures = 0
+        self.stats['opened'] += 1
+        print(f"Circuit breaker {self.name} opened")
+
+    def available(self):
+        # Cheap check for callers that want to skip work entirely while open
+        with self._lock:
+            return self.state != OPEN or time.time() - self.opened_at >= self.reset_timeout
+
+    def allow(self):
+        # Reserve a call, returns False when it should be rejected
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.stats['rejected'] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self.stats['rejected'] += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self.last_success_at = time.time()
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.opened_at = None
+                self._probes = 0
+                print(f"Circuit breaker {self.name} closed")
+                return
+            now = time.time()
+            self._outcomes.append((now, False))
+            self._trim(now)
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            now = time.time()
+            self.last_failure_at = now
+            if self.state == HALF_OPEN:
+                self._open(now)
+                return
+            if self.state == OPEN:
+                return
+
+            self._outcomes.append((now, True))
+            self._failures += 1
+            self._trim(now)
+            calls = len(self._outcomes)
+            if calls >= self.minimum_calls and self._failures / calls >= self.failure_rate_threshold:
+                self._open(now)
+
+    def release(self):
+        # A reserved call finished without telling us anything about the service
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit breaker {self.name} is open, try again later.")
+        try:
+            result = func(*args, **kwargs)
+        except self.ignored_exceptions:
+            self.release()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return wrapper
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.time())
+            calls = len(self._outcomes)
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['window_calls'] = calls
+            stats['window_failures'] = self._failures
+            stats['failure_rate'] = round(self._failures / calls, 3) if calls else 0.0
+            stats['last_success_at'] = self.last_success_at
+            stats['last_failure_at'] = self.last_failure_at
+            if self.opened_at is not None:
+                stats['opened_at'] = self.opened_at
+        return stats
+
+# One breaker per endpoint (an API, a host), created on first use. Only the
+# most recently used max_entries breakers are kept.
+class CircuitBreakerRegistry:
+    def __init__(self, max_entries=10000, **breaker_config):
+        self.max_entries = max_entries
+        self.breaker_config = breaker_config
+        self._breakers = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, **self.breaker_config)
+                if len(self._breakers) > self.max_entries:
+                    self._breakers.popitem(last=False)
+            else:
+                self._breakers.move_to_end(name)
+            return breaker
+
+    def snapshot(self, include_closed=True):
+        with self._lock:
+            breakers = list(self._breakers.values())
+
+        states = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        opened = 0
+        endpoints = {}
+        for breaker in breakers:
+            stats = breaker.snapshot()
+            states[stats['state']] += 1
+            opened += stats['opened']
+            if include_closed or stats['state'] != CLOSED:
+                endpoints[breaker.name] = stats
+        return {'states': states, 'opened': opened, 'endpoints': endpoints}
@@ -0,0 +1,120 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+from urllib3.util import connection as urllib3_connection
+from urllib3.util.retry import Retry
+
+# Connection counters: every request that didn't open a new socket reused one
+# from the per-host keep-alive pool
+_stats_lock = threading.Lock()
+connection_stats = {'requests': 0, 'new_connections': 0, 'dns_hits': 0, 'dns_misses': 0}
+host_connection_stats = OrderedDict()
+max_tracked_hosts = 1000
+
+# Resolved addresses per (host, port), shared by every pooled connection
+_dns_cache = {}
+_dns_lock = threading.Lock()
+max_dns_entries = 10000
+_original_create_connection = urllib3_connection.create_connection
+
+def build_session(max_hosts, per_host_connections, max_retries=0):
+    # Keep-alive session with one pool per host sized to the worker concurrency.
+    # A read timeout is never retried here: each retry would get a fresh timeout
+    # that no caller's deadline can cut short.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_hosts,
+        pool_maxsize=per_host_connections,
+        max_retries=Retry(total=max_retries, read=False)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(_count_request)
+    return session
+
+def install_dns_cache(ttl=300, negative_ttl=30):
+    # Route urllib3's socket creation through the cached resolver
+    def create_connection(address, *args, **kwargs):
+        host, port = address
+        addresses = _resolve(host, port, ttl, negative_ttl)
+
+        _count_new_connection(host)
+
+        last_error = None
+        for _, _, _, _, sockaddr in addresses:
+            try:
+                return _original_create_connection((sockaddr[0], port), *args, **kwargs)
+            except OSError as e:
+                last_error = e
+        raise last_error
+
+    urllib3_connection.create_connection = create_connection
+
+def _resolve(host, port, ttl, negative_ttl):
+    key = (host, port)
+    now = time.time()
+
+    with _dns_lock:
+        cached = _dns_cache.get(key)
+    if cached is not None and cached[0] > now:
+        with _stats_lock:
+            connection_stats['dns_hits'] += 1
+        if isinstance(cached[1], socket.gaierror):
+            raise cached[1]
+        return cached[1]
+
+    with _stats_lock:
+        connection_stats['dns_misses'] += 1
+    try:
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        # Remember failed lookups briefly so dead domains don't hit DNS on every probe
+        with _dns_lock:
+            _dns_cache[key] = (now + negative_ttl, e)
+        raise
+
+    with _dns_lock:
+        # Drop expired entries before the cache grows past its limit
+        if len(_dns_cache) >= max_dns_entries:
+            for stale_key in [k for k, v in _dns_cache.items() if v[0] <= now]:
+                del _dns_cache[stale_key]
+        _dns_cache[key] = (now + ttl, addresses)
+    return addresses
+
+def _count_request(response, *args, **kwargs):
+    _count('requests', urlparse(response.url).hostname)
+
+def _count_new_connection(host):
+    _count('new_connections', host)
+
+def _count(counter, host):
+    with _stats_lock:
+        connection_stats[counter] += 1
+
+        # Per-host counters for the most recently used hosts only
+        host_stats = host_connection_stats.get(host)
+        if host_stats is None:
+            host_stats = host_connection_stats[host] = {'requests': 0, 'new_connections': 0}
+            if len(host_connection_stats) > max_tracked_hosts:
+                host_connection_stats.popitem(last=False)
+        else:
+            host_connection_stats.move_to_end(host)
+        host_stats[counter] += 1
+
+def get_connection_stats():
+    with _stats_lock:
+        stats = dict(connection_stats)
+        stats['pool_hits'] = max(stats['requests'] - stats['new_connections'], 0)
+        stats['pool_misses'] = stats['new_connections']
+        stats['hosts'] = {host: dict(values) for host, values in host_connection_stats.items()}
+    return stats
+
+def reset_connection_stats():
+    with _stats_lock:
+        for key in connection_stats:
+            connection_stats[key] = 0
+        host_connection_stats.clear()
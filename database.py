@@ -4,7 +4,14 @@ from dotenv import load_dotenv
 
 import pymongo
 from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 import time
+import threading
+import atexit
+
+import metrics
+from url_utils import normalize_host
+from sitemap_records import urls_from_bytes
 
 # Mongodb connection and collection vars
 client = None
@@ -35,8 +42,9 @@ def init_db():
     # Create index for faster lookups
     try:
         company_collection.create_index([('company_name', pymongo.ASCENDING)], unique=True)
-        # Add normalized website URL index for deduplication
         company_collection.create_index([('website_url', pymongo.ASCENDING)])
+        # Normalized host (no scheme, www. or port) for deduplicating sites
+        company_collection.create_index([('website_host', pymongo.ASCENDING)])
         # Add timestamp index for sorting by freshness
         company_collection.create_index([('last_updated', pymongo.DESCENDING)])
     except Exception as e:
@@ -49,14 +57,15 @@ def store_company_data(company_data):
     if 'last_updated' not in company_data:
         company_data['last_updated'] = time.time()
         
-    # Normalize company name (lowercase for matching)
+    # Normalize company name (lowercase for matching) and website host
     company_data['company_name_normalized'] = company_data['company_name'].lower()
+    company_data['website_host'] = normalize_host(company_data.get('website_url') or '')
 
     # Upsert operation - update if exists, insert if not
     try:
         result = company_collection.update_one(
             {'company_name': company_data['company_name']},
-            {'$set': company_data},
+            {'$set': company_data, '$unset': {'sitemap_urls': ''}},
             upsert=True
         )
         return True
@@ -88,30 +97,142 @@ def store_companies_batch(company_data_list):
         if 'last_updated' not in company_data:
             company_data['last_updated'] = time.time()
         company_data['company_name_normalized'] = company_data['company_name'].lower()
+        company_data['website_host'] = normalize_host(company_data.get('website_url') or '')
     
     operations = []
     for company_data in company_data_list:
         operations.append(
             pymongo.UpdateOne(
                 {'company_name': company_data['company_name']},
-                {'$set': company_data},
+                {'$set': company_data, '$unset': {'sitemap_urls': ''}},
                 upsert=True
             )
         )
     
     if operations:
         try:
-            result = company_collection.bulk_write(operations)
+            # Unordered so one bad document doesn't stop the rest of the batch
+            result = company_collection.bulk_write(operations, ordered=False)
             print(f"Batch operation completed: {result.upserted_count} inserted, {result.modified_count} modified")
             return result
+        except BulkWriteError as e:
+            # Everything except the failed operations was written, retry only those
+            failed = [company_data_list[error['index']] for error in e.details.get('writeErrors', [])]
+            print(f"Error in batch operation: {len(failed)} of {len(company_data_list)} writes failed")
+            retry_list = failed
         except Exception as e:
             print(f"Error in batch operation: {str(e)}")
-            # Fallback to individual operations
-            for company_data in company_data_list:
-                try:
-                    store_company_data(company_data)
-                except Exception as inner_e:
-                    print(f"Error storing {company_data['company_name']}: {str(inner_e)}")
+            retry_list = company_data_list
+
+        # Fallback to individual operations
+        for company_data in retry_list:
+            try:
+                store_company_data(company_data)
+            except Exception as inner_e:
+                print(f"Error storing {company_data['company_name']}: {str(inner_e)}")
+
+# Write-behind buffer: collects finished company documents and writes them with
+# store_companies_batch once max_size documents are waiting or the oldest has
+# waited flush_interval seconds. Anything left is flushed on close/exit.
+class WriteBehindBuffer:
+    def __init__(self, max_size=50, flush_interval=2.0):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.stats = {
+            'flushes': 0,
+            'documents': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, company_data):
+        with self._lock:
+            self._pending.append(company_data)
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = len(self._pending) >= self.max_size
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def _run(self):
+        # Time-based flushes for batches that never fill up
+        while not self._closed:
+            with self._lock:
+                oldest = self._oldest
+            if oldest is None:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            wait = oldest + self.flush_interval - time.time()
+            if wait > 0:
+                time.sleep(min(wait, self.flush_interval))
+                continue
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                self._oldest = None
+            if not batch:
+                return
+
+            started = time.time()
+            try:
+                store_companies_batch(batch)
+            except Exception as e:
+                print(f"Error flushing {len(batch)} buffered companies: {str(e)}")
+            elapsed = time.time() - started
+            metrics.db_write_seconds.observe(elapsed)
+            metrics.db_write_documents.inc(len(batch))
+
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['documents'] += len(batch)
+                self.stats['last_batch_size'] = len(batch)
+                self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+                self.stats['last_flush_seconds'] = elapsed
+                self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+                self.stats['total_flush_seconds'] += elapsed
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+        flushes = stats['flushes'] or 1
+        stats['avg_batch_size'] = stats['documents'] / flushes
+        stats['avg_flush_seconds'] = stats['total_flush_seconds'] / flushes
+        return stats
+
+def company_urls(document):
+    # Page URLs of a company document, built from its stored SitemapRecords.
+    # Documents written before the table was stored still carry a URL list.
+    metadata = document.get('sitemap_metadata')
+    if metadata is not None:
+        return urls_from_bytes(metadata)
+    return document.get('sitemap_urls') or []
 
 def get_company_data(company_name):
     global company_collection
@@ -122,8 +243,11 @@ def get_company_data(company_name):
 def get_company_by_website(website_url):
     global company_collection
     
-    # Find company by website URL
-    return company_collection.find_one({'website_url': website_url})
+    # Find the most recent company on the same site, whatever scheme, www. or path it was listed with
+    return company_collection.find_one(
+        {'website_host': normalize_host(website_url)},
+        sort=[('last_updated', pymongo.DESCENDING)]
+    )
 
 def get_all_companies():
     global company_collection
@@ -131,6 +255,19 @@ def get_all_companies():
     # Return all companies
     return list(company_collection.find())
 
+def iter_company_documents(batch_size=200):
+    global company_collection
+
+    # The URLs are read from the stored SitemapRecords, older documents have a URL list
+    projection = {'company_name': True, 'website_url': True, 'sitemap_urls': True, 'ai_insights': True,
+                  'sitemap_metadata': True}
+
+    # Stream all companies, most recent first, one cursor batch at a time
+    return company_collection.find(
+        {},
+        projection=projection
+    ).sort('last_updated', pymongo.DESCENDING).batch_size(batch_size)
+
 def reset_database():
     global company_collection
     try:
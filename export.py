@@ -0,0 +1,140 @@
+import csv
+import io
+import tempfile
+
+from sitemap_records import urls_from_bytes
+
+# pyarrow is optional, only needed for the columnar exports
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+CSV_COLUMNS = ['Company', 'Website', 'Sitemap Complete', 'Insight from Prompt']
+
+# Rows are buffered into groups of this size before they are written out
+rows_per_chunk = 200
+
+def columnar_available():
+    return pa is not None
+
+def result_rows(results):
+    # Job results -> (company, website, urls, insights, no metadata), newest result per company
+    seen_companies = set()
+    for result in results:
+        company_name = result['Company']
+        if company_name in seen_companies:
+            continue
+        seen_companies.add(company_name)
+
+        urls = result.get('Sitemap URLs')
+        if urls is None:
+            # Stored before results carried the list
+            sitemap = result.get('Sitemap Complete') or ''
+            urls = sitemap.split(', ') if sitemap else []
+        yield company_name, result['Website'], urls, result.get('Insight from Prompt'), None
+
+def document_rows(documents):
+    # Company documents from MongoDB -> (company, website, urls, insights, sitemap metadata)
+    for document in documents:
+        # The URL list is built from the stored table, older documents carry one
+        metadata = document.get('sitemap_metadata')
+        yield (
+            document.get('company_name'),
+            document.get('website_url'),
+            urls_from_bytes(metadata) if metadata is not None else document.get('sitemap_urls') or [],
+            document.get('ai_insights'),
+            bytes(metadata) if metadata is not None else None
+        )
+
+def csv_stream(rows):
+    # Yield the CSV a chunk of rows at a time instead of building it in memory
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+
+    count = 0
+    for company_name, website_url, urls, insights, _ in rows:
+        writer.writerow([company_name, website_url, ", ".join(urls), insights])
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def _arrow_schema():
+    return pa.schema([
+        ('company', pa.string()),
+        ('website', pa.string()),
+        ('sitemap_urls', pa.list_(pa.string())),
+        ('insights', pa.string()),
+        # Compressed SitemapRecords, see sitemap_records.SitemapRecords.from_bytes
+        ('sitemap_metadata', pa.binary()),
+    ])
+
+def _record_batches(rows, schema):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= rows_per_chunk:
+            yield _to_record_batch(chunk, schema)
+            chunk = []
+    if chunk:
+        yield _to_record_batch(chunk, schema)
+
+def _to_record_batch(chunk, schema):
+    columns = list(zip(*chunk))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(list(column), type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+class _ChunkSink:
+    # File-like sink that hands back whatever was written since the last drain
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def arrow_stream(rows):
+    # Arrow IPC stream, each record batch is sent as soon as it is built
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield sink.drain()
+
+    for record_batch in _record_batches(rows, schema):
+        writer.write_batch(record_batch)
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+def write_parquet(rows):
+    # Parquet needs its footer at the end, so row groups go to a temp file
+    # that spills to disk once it grows past a few MB
+    schema = _arrow_schema()
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for record_batch in _record_batches(rows, schema):
+            writer.write_batch(record_batch)
+    output.seek(0)
+    return output
@@ -0,0 +1,120 @@
+import threading
+import time
+
+from circuit_breaker import OPEN, HALF_OPEN
+
+OK = 'ok'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+# Dependency status for the health endpoints, refreshed by a background thread.
+# Probes only read the cached result, so they stay cheap however often they run.
+class HealthMonitor:
+    def __init__(self, interval=15):
+        self.interval = interval
+        self.checked_at = None
+        self._checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_check(self, name, check, critical=True):
+        # check() returns (status, detail), an exception counts as down.
+        # Only critical checks decide readiness.
+        self._checks[name] = (check, critical)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        results = {}
+        for name, (check, critical) in list(self._checks.items()):
+            started = time.time()
+            try:
+                status, detail = check()
+            except Exception as e:
+                status, detail = DOWN, f"error: {str(e)}"
+            results[name] = {
+                'status': status,
+                'detail': detail,
+                'critical': critical,
+                'duration_ms': round((time.time() - started) * 1000, 1),
+            }
+        with self._lock:
+            self._results = results
+            self.checked_at = time.time()
+
+    def result(self, name):
+        with self._lock:
+            return self._results.get(name)
+
+    def snapshot(self):
+        with self._lock:
+            results = dict(self._results)
+            checked_at = self.checked_at
+
+        if checked_at is None:
+            return {'status': 'starting', 'ready': False, 'checked_at': None, 'checks': {}}
+
+        age = time.time() - checked_at
+        statuses = [result['status'] for result in results.values()]
+        critical_down = any(r['status'] == DOWN for r in results.values() if r['critical'])
+
+        if critical_down:
+            overall = DOWN
+        elif any(status != OK for status in statuses):
+            overall = DEGRADED
+        else:
+            overall = OK
+
+        # A result much older than the interval means the refresh thread is stuck
+        stale = age > 3 * self.interval
+        return {
+            'status': overall,
+            'ready': not critical_down and not stale,
+            'stale': stale,
+            'checked_at': checked_at,
+            'age_seconds': round(age, 1),
+            'checks': results,
+        }
+
+def mongo_check():
+    import database
+    database.db.command('ping')
+    return OK, 'OK'
+
+def breaker_check(breaker):
+    # From the breaker state and its recent calls, no request to the service itself
+    stats = breaker.snapshot()
+    if stats['state'] == OPEN:
+        return DOWN, f"error: circuit breaker open after {stats['window_failures'] or stats['failures']} failures"
+    if stats['state'] == HALF_OPEN:
+        return DEGRADED, 'recovering: circuit breaker half-open'
+    if stats['window_failures']:
+        return DEGRADED, f"{stats['window_failures']} of the last {stats['window_calls']} calls failed"
+    return OK, 'OK'
+
+def job_store_check(job_store):
+    # /health serves these counts from the cached result instead of counting per request
+    counts = job_store.counts()
+    return OK, {status: counts.get(status, 0) for status in ('queued', 'processing', 'complete', 'error')}
+
+def pipeline_check(pipeline):
+    alive = pipeline.alive_workers()
+    expected = len(pipeline._threads)
+    if alive == 0:
+        return DOWN, 'error: no pipeline workers running'
+    # Jobs pile up in front of a stage with no workers, nothing ever completes
+    dead = pipeline.dead_stages()
+    if dead:
+        return DOWN, f"error: no {', '.join(dead)} workers running"
+    if alive < expected:
+        return DEGRADED, f"{alive} of {expected} pipeline workers running"
+    return OK, f"{alive} workers running"
@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# On-disk cache of validators (ETag / Last-Modified) and parsed results per URL.
+# A 304 on revalidation lets callers reuse the parsed result instead of
+# downloading and parsing the body again.
+class HTTPCache:
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl=14 * 24 * 3600, evict_every=50):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {'revalidated': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+    def _connect(self):
+        # One connection per thread, the database file is shared across processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS http_cache (
+                                key TEXT PRIMARY KEY,
+                                etag TEXT,
+                                last_modified TEXT,
+                                payload BLOB,
+                                size INTEGER,
+                                stored_at REAL,
+                                last_access REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_http_cache_access ON http_cache (last_access)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT etag, last_modified, payload, stored_at FROM http_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        etag, last_modified, payload, stored_at = row
+        if time.time() - stored_at > self.ttl:
+            self.delete(key)
+            return None
+
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'payload': json.loads(zlib.decompress(payload)),
+        }
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry is None:
+            return headers
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, key, etag, last_modified, payload):
+        # Nothing to revalidate against without a validator
+        if not etag and not last_modified:
+            return
+
+        blob = zlib.compress(json.dumps(payload).encode())
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, etag, last_modified, blob, len(blob) + len(key), now, now)
+        )
+        conn.commit()
+
+        with self._lock:
+            self.stats['stored'] += 1
+            self._writes += 1
+            run_eviction = self._writes % self.evict_every == 0
+        if run_eviction:
+            self.evict()
+
+    def touch(self, key):
+        # Revalidated entries start a new TTL period
+        now = time.time()
+        conn = self._connect()
+        conn.execute('UPDATE http_cache SET stored_at = ?, last_access = ? WHERE key = ?', (now, now, key))
+        conn.commit()
+        with self._lock:
+            self.stats['revalidated'] += 1
+
+    def miss(self):
+        with self._lock:
+            self.stats['misses'] += 1
+
+    def delete(self, key):
+        conn = self._connect()
+        conn.execute('DELETE FROM http_cache WHERE key = ?', (key,))
+        conn.commit()
+
+    def evict(self):
+        conn = self._connect()
+        evicted = conn.execute('DELETE FROM http_cache WHERE stored_at < ?', (time.time() - self.ttl,)).rowcount
+
+        # Drop least recently used entries until we are back under the size limit
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        if total > self.max_bytes:
+            freed = 0
+            victims = []
+            for key, size in conn.execute('SELECT key, size FROM http_cache ORDER BY last_access'):
+                victims.append((key,))
+                freed += size
+                if total - freed <= self.max_bytes:
+                    break
+            conn.executemany('DELETE FROM http_cache WHERE key = ?', victims)
+            evicted += len(victims)
+        conn.commit()
+
+        with self._lock:
+            self.stats['evicted'] += evicted
+        return evicted
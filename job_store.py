@@ -0,0 +1,481 @@
+import os
+import json
+import datetime
+import sqlite3
+import threading
+import time
+
+import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# Raised when the queue is at capacity and didn't drain within the timeout
+class QueueFull(Exception):
+    pass
+
+def _job_summary(job_id, status, payload, message):
+    # Small per-job record for progress updates, without the sitemap or insights
+    summary = {
+        'job_id': job_id,
+        'status': status,
+        'company': payload.get('company_name'),
+        'website': payload.get('website_url'),
+    }
+    if message:
+        summary['message'] = message
+    return summary
+
+def _batch_progress(batch_id, total, complete, error, cursor, jobs):
+    pending = max(total - complete - error, 0)
+    return {
+        'batch_id': batch_id,
+        'total': total,
+        'complete': complete,
+        'error': error,
+        'pending': pending,
+        'done': pending == 0,
+        'cursor': cursor,
+        'jobs': jobs,
+    }
+
+def _result_entry(status, result, message):
+    # Same shape the old in-memory results dict used
+    entry = {'status': status}
+    if status == 'complete':
+        entry['data'] = result
+    elif status == 'error':
+        entry['message'] = message
+    return entry
+
+# Admission and backpressure shared by both backends. Each store provides
+# pending_count() and _insert_jobs(), which returns how many jobs were new.
+class JobStore:
+    def wait_for_room(self, count, timeout):
+        # Backpressure: wait for room in the queue, then give up.
+        # A timeout of None skips the check, for jobs that were already admitted.
+        if timeout is None:
+            return
+        wait_until = time.time() + timeout
+        while self.pending_count() + count > self.capacity:
+            if time.time() >= wait_until:
+                raise QueueFull(f"Job queue is full ({self.capacity} pending jobs)")
+            time.sleep(0.1)
+
+    def enqueue(self, job_id, batch_id, payload, timeout=0):
+        return self.enqueue_many(batch_id, [(job_id, payload, None)], timeout)
+
+    def enqueue_many(self, batch_id, jobs, timeout=0):
+        # jobs are (job_id, payload, dedup_key), repeated keys in a batch are skipped
+        self.wait_for_room(len(jobs), timeout)
+        return self._insert_jobs(batch_id, jobs)
+
+# Durable job queue and results store on a SQLite file. The file can be shared
+# by several worker processes on the same host.
+class SQLiteJobStore(JobStore):
+    def __init__(self, path, capacity=10000, result_ttl=24 * 3600, visibility_timeout=600):
+        self.path = path
+        self.capacity = capacity
+        self.result_ttl = result_ttl
+        self.visibility_timeout = visibility_timeout
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                            job_id TEXT PRIMARY KEY,
+                            batch_id TEXT,
+                            payload TEXT,
+                            status TEXT,
+                            result TEXT,
+                            message TEXT,
+                            created_at REAL,
+                            claimed_at REAL,
+                            finished_at REAL,
+                            dedup_key TEXT,
+                            seq INTEGER)''')
+        # Stores created before these columns existed
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        for column, column_type in (('dedup_key', 'TEXT'), ('seq', 'INTEGER')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+        # Per-batch counters so progress checks don't scan the batch
+        conn.execute('''CREATE TABLE IF NOT EXISTS batches (
+                            batch_id TEXT PRIMARY KEY,
+                            total INTEGER,
+                            complete INTEGER,
+                            error INTEGER,
+                            created_at REAL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (batch_id, dedup_key)')
+        # seq orders finished jobs, so clients can ask for whatever changed since a cursor
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs (seq)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch_seq ON jobs (batch_id, seq)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_batches_created ON batches (created_at)')
+
+    def _connect(self):
+        # One connection per thread, autocommit mode so we control transactions
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def pending_count(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+    def _insert_jobs(self, batch_id, jobs):
+        # jobs are (job_id, payload, dedup_key), repeated keys in a batch are skipped
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job_id, batch_id, payload, status, created_at, dedup_key) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                [(job_id, batch_id, json.dumps(payload), now, dedup_key) for job_id, payload, dedup_key in jobs]
+            )
+            inserted = cursor.rowcount
+            if batch_id is not None:
+                conn.execute(
+                    'INSERT INTO batches (batch_id, total, complete, error, created_at) VALUES (?, ?, 0, 0, ?) '
+                    'ON CONFLICT(batch_id) DO UPDATE SET total = total + excluded.total',
+                    (batch_id, inserted, now)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return inserted
+
+    def claim(self):
+        # Atomically move the oldest queued job to processing
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT job_id, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'processing', claimed_at = ? WHERE job_id = ?",
+                    (time.time(), row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _finish(self, job_id, status, result, message):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # A requeued job can finish twice, only the first one counts
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, message = ?, finished_at = ?, "
+                "seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs) "
+                "WHERE job_id = ? AND status NOT IN ('complete', 'error')",
+                (status, result, message, time.time(), job_id)
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    f'UPDATE batches SET {status} = {status} + 1 '
+                    'WHERE batch_id = (SELECT batch_id FROM jobs WHERE job_id = ?)',
+                    (job_id,)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def complete(self, job_id, result):
+        self._finish(job_id, 'complete', json.dumps(result), None)
+
+    def fail(self, job_id, message):
+        self._finish(job_id, 'error', None, message)
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            'SELECT status, result, message FROM jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, result, message = row
+        return _result_entry(status, json.loads(result) if result else None, message)
+
+    def batch_results(self, batch_id):
+        rows = self._connect().execute(
+            'SELECT job_id, status, result, message FROM jobs WHERE batch_id = ? ORDER BY created_at',
+            (batch_id,)
+        )
+        return {
+            job_id: _result_entry(status, json.loads(result) if result else None, message)
+            for job_id, status, result, message in rows
+        }
+
+    def batch_progress(self, batch_id, cursor=0, limit=500):
+        # Aggregate counts plus the jobs that finished after the cursor
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT total, complete, error FROM batches WHERE batch_id = ?', (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        jobs = []
+        rows = conn.execute(
+            'SELECT job_id, seq, status, payload, message FROM jobs '
+            'WHERE batch_id = ? AND seq > ? ORDER BY seq LIMIT ?',
+            (batch_id, cursor, limit)
+        )
+        for job_id, seq, status, payload, message in rows:
+            jobs.append(_job_summary(job_id, status, json.loads(payload), message))
+            cursor = seq
+
+        return _batch_progress(batch_id, row[0], row[1], row[2], cursor, jobs)
+
+    def iter_completed_results(self, batch_id, page_size=200):
+        # Newest first, one page in memory at a time
+        conn = self._connect()
+        cursor = None
+        while True:
+            if cursor is None:
+                rows = conn.execute(
+                    "SELECT seq, result FROM jobs WHERE batch_id = ? AND status = 'complete' "
+                    "ORDER BY seq DESC LIMIT ?",
+                    (batch_id, page_size)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT seq, result FROM jobs WHERE batch_id = ? AND status = 'complete' AND seq < ? "
+                    "ORDER BY seq DESC LIMIT ?",
+                    (batch_id, cursor, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for seq, result in rows:
+                yield json.loads(result)
+            cursor = rows[-1][0]
+
+    def latest_batch(self):
+        row = self._connect().execute(
+            'SELECT batch_id FROM batches ORDER BY created_at DESC LIMIT 1'
+        ).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+        return dict(rows.fetchall())
+
+    def purge_expired(self):
+        # Drop finished jobs once their results are past the TTL
+        conn = self._connect()
+        expired_before = time.time() - self.result_ttl
+        purged = conn.execute(
+            'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+            (expired_before,)
+        ).rowcount
+        conn.execute(
+            'DELETE FROM batches WHERE created_at < ? '
+            'AND NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.batch_id = batches.batch_id)',
+            (expired_before,)
+        )
+        return purged
+
+    def requeue_stale(self):
+        # Jobs claimed by a worker that died (or a restart) go back to the queue
+        return self._connect().execute(
+            "UPDATE jobs SET status = 'queued', claimed_at = NULL WHERE status = 'processing' AND claimed_at < ?",
+            (time.time() - self.visibility_timeout,)
+        ).rowcount
+
+# Same interface backed by the MongoDB database from database.py
+class MongoJobStore(JobStore):
+    def __init__(self, db, capacity=10000, result_ttl=24 * 3600, visibility_timeout=600):
+        self.capacity = capacity
+        self.result_ttl = result_ttl
+        self.visibility_timeout = visibility_timeout
+        self.jobs = db['jobs']
+        self.batches = db['job_batches']
+        self.counters = db['job_counters']
+
+        try:
+            self.jobs.create_index([('status', pymongo.ASCENDING), ('created_at', pymongo.ASCENDING)])
+            self.jobs.create_index([('batch_id', pymongo.ASCENDING)])
+            self.jobs.create_index(
+                [('batch_id', pymongo.ASCENDING), ('dedup_key', pymongo.ASCENDING)],
+                unique=True,
+                partialFilterExpression={'dedup_key': {'$exists': True}}
+            )
+            self.jobs.create_index([('batch_id', pymongo.ASCENDING), ('seq', pymongo.ASCENDING)])
+            # Mongo removes finished jobs on its own once expires_at has passed
+            self.jobs.create_index([('expires_at', pymongo.ASCENDING)], expireAfterSeconds=0)
+            self.batches.create_index([('created_at', pymongo.DESCENDING)])
+            self.batches.create_index([('expires_at', pymongo.ASCENDING)], expireAfterSeconds=0)
+        except Exception as e:
+            print(f"Error creating job indexes: {str(e)}")
+
+    def pending_count(self):
+        return self.jobs.count_documents({'status': 'queued'})
+
+    def _insert_jobs(self, batch_id, jobs):
+        # jobs are (job_id, payload, dedup_key), repeated keys in a batch are skipped
+        now = time.time()
+        documents = []
+        for job_id, payload, dedup_key in jobs:
+            document = {
+                '_id': job_id,
+                'batch_id': batch_id,
+                'payload': payload,
+                'status': 'queued',
+                'created_at': now
+            }
+            if dedup_key is not None:
+                document['dedup_key'] = dedup_key
+            documents.append(document)
+
+        try:
+            inserted = len(self.jobs.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate keys are expected, everything else was inserted
+            inserted = e.details.get('nInserted', 0)
+
+        if batch_id is not None:
+            self.batches.update_one(
+                {'_id': batch_id},
+                {
+                    '$inc': {'total': inserted},
+                    '$setOnInsert': {'created_at': now, 'complete': 0, 'error': 0},
+                    '$set': {'expires_at': _utc_datetime(now + self.result_ttl)}
+                },
+                upsert=True
+            )
+        return inserted
+
+    def claim(self):
+        job = self.jobs.find_one_and_update(
+            {'status': 'queued'},
+            {'$set': {'status': 'processing', 'claimed_at': time.time()}},
+            sort=[('created_at', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            return None
+        return job['_id'], job['payload']
+
+    def _next_seq(self):
+        counter = self.counters.find_one_and_update(
+            {'_id': 'job_seq'},
+            {'$inc': {'value': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['value']
+
+    def _finish(self, job_id, fields):
+        now = time.time()
+        expires_at = _utc_datetime(now + self.result_ttl)
+        fields.update({'finished_at': now, 'expires_at': expires_at, 'seq': self._next_seq()})
+
+        # A requeued job can finish twice, only the first one counts
+        job = self.jobs.find_one_and_update(
+            {'_id': job_id, 'status': {'$nin': ['complete', 'error']}},
+            {'$set': fields},
+            projection={'batch_id': True}
+        )
+        if job is not None and job.get('batch_id') is not None:
+            self.batches.update_one(
+                {'_id': job['batch_id']},
+                {'$inc': {fields['status']: 1}, '$set': {'expires_at': expires_at}}
+            )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, {'status': 'complete', 'result': result})
+
+    def fail(self, job_id, message):
+        self._finish(job_id, {'status': 'error', 'message': message})
+
+    def get(self, job_id):
+        job = self.jobs.find_one({'_id': job_id})
+        if job is None:
+            return None
+        return _result_entry(job['status'], job.get('result'), job.get('message'))
+
+    def batch_results(self, batch_id):
+        cursor = self.jobs.find({'batch_id': batch_id}).sort('created_at', pymongo.ASCENDING)
+        return {
+            job['_id']: _result_entry(job['status'], job.get('result'), job.get('message'))
+            for job in cursor
+        }
+
+    def batch_progress(self, batch_id, cursor=0, limit=500):
+        # Aggregate counts plus the jobs that finished after the cursor
+        batch = self.batches.find_one({'_id': batch_id})
+        if batch is None:
+            return None
+
+        jobs = []
+        finished = self.jobs.find(
+            {'batch_id': batch_id, 'seq': {'$gt': cursor}},
+            projection={'status': True, 'payload': True, 'message': True, 'seq': True}
+        ).sort('seq', pymongo.ASCENDING).limit(limit)
+        for job in finished:
+            jobs.append(_job_summary(job['_id'], job['status'], job['payload'], job.get('message')))
+            cursor = job['seq']
+
+        return _batch_progress(batch_id, batch['total'], batch['complete'], batch['error'], cursor, jobs)
+
+    def iter_completed_results(self, batch_id, page_size=200):
+        # Newest first, the cursor fetches one page at a time
+        cursor = self.jobs.find(
+            {'batch_id': batch_id, 'status': 'complete'},
+            projection={'result': True}
+        ).sort('seq', pymongo.DESCENDING).batch_size(page_size)
+        for job in cursor:
+            yield job['result']
+
+    def latest_batch(self):
+        batch = self.batches.find_one({}, sort=[('created_at', pymongo.DESCENDING)])
+        return batch['_id'] if batch else None
+
+    def counts(self):
+        pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+        return {row['_id']: row['count'] for row in self.jobs.aggregate(pipeline)}
+
+    def purge_expired(self):
+        # Handled by the TTL index on expires_at
+        return 0
+
+    def requeue_stale(self):
+        result = self.jobs.update_many(
+            {'status': 'processing', 'claimed_at': {'$lt': time.time() - self.visibility_timeout}},
+            {'$set': {'status': 'queued', 'claimed_at': None}}
+        )
+        return result.modified_count
+
+def _utc_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+def create_job_store():
+    # Pick the job backend from the environment (sqlite by default)
+    backend = os.getenv('JOB_BACKEND', 'sqlite').lower()
+    capacity = int(os.getenv('JOB_QUEUE_CAPACITY', '10000'))
+    result_ttl = int(os.getenv('JOB_RESULT_TTL', str(24 * 3600)))
+    visibility_timeout = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '600'))
+
+    if backend == 'mongo':
+        import database
+        return MongoJobStore(database.db, capacity, result_ttl, visibility_timeout)
+
+    return SQLiteJobStore(
+        os.getenv('JOB_DB_PATH', 'jobs.sqlite3'),
+        capacity, result_ttl, visibility_timeout
+    )
@@ -0,0 +1,218 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Minimal Prometheus metrics: counters, gauges and histograms with labels,
+# plus collectors that turn existing stats dicts into samples when /metrics is
+# scraped. Values are per process.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        # collector() returns [(name, type, help, [(labels dict, value), ...]), ...]
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector error: {str(e)}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def _children_snapshot(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for values, child in self._children_snapshot():
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+class _ValueChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self.value)}']
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self._children[()].dec(amount)
+
+    def set(self, value):
+        self._children[()].set(value)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total_count = self.count
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, values, [("le", _format_value(float(bound)))])} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labelnames, values, [("le", "+Inf")])} {total_count}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, values)} {_format_value(total_sum)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, values)} {total_count}')
+        return lines
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+def render():
+    return REGISTRY.render()
+
+def register_collector(collector):
+    return REGISTRY.register_collector(collector)
+
+# Metrics shared across modules
+fetch_seconds = Histogram('scraper_fetch_seconds', 'Time to response headers for scraper requests', ['kind'])
+parse_seconds = Histogram('scraper_parse_seconds', 'Time to read and parse scraper response bodies', ['kind'])
+extract_seconds = Histogram('scraper_extract_seconds', 'Total time of one sitemap extraction')
+html_fallbacks = Counter('scraper_html_fallbacks_total', 'Extractions that fell back to scraping HTML links')
+ai_request_seconds = Histogram('ai_request_seconds', 'Latency of Gemini requests', ['mode'])
+ai_timeouts = Counter('ai_timeouts_total', 'Gemini requests that ran past their timeout')
+db_write_seconds = Histogram('db_write_seconds', 'Latency of batched company writes to MongoDB')
+db_write_documents = Counter('db_write_documents_total', 'Company documents written to MongoDB')
+stage_seconds = Histogram('pipeline_stage_seconds', 'Time one item spends in a pipeline stage', ['stage'])
@@ -0,0 +1,415 @@
+import os
+import queue
+import threading
+import time
+import concurrent.futures
+import multiprocessing
+
+from scraper import extract_sitemap_records
+import ai_processor
+from ai_processor import AI_ERROR_PREFIX, analyze_sitemap_with_ai, analyze_sitemaps_batch
+from database import WriteBehindBuffer, get_company_data, get_company_by_website, company_urls
+from ai_cache import sitemap_fingerprint
+from sitemap_records import urls_from_bytes
+from url_utils import normalize_host, same_site
+import metrics
+
+def pipeline_config_from_env():
+    # Stage sizes, overridable from the environment or the worker CLI
+    return {
+        'scrape_workers': int(os.getenv('SCRAPE_WORKERS', '20')),
+        'scrape_processes': int(os.getenv('SCRAPE_PROCESSES', '0')),
+        'ai_workers': int(os.getenv('AI_WORKERS', '4')),
+        'store_batch_size': int(os.getenv('STORE_BATCH_SIZE', '20')),
+        'store_flush_interval': float(os.getenv('STORE_FLUSH_INTERVAL', '2')),
+        'queue_size': int(os.getenv('STAGE_QUEUE_SIZE', '100')),
+        'poll_interval': float(os.getenv('JOB_POLL_INTERVAL', '0.5')),
+        'ai_batch_wait': float(os.getenv('AI_BATCH_WAIT', '0.2')),
+        'freshness_window': float(os.getenv('INCREMENTAL_FRESHNESS_SECONDS', str(7 * 24 * 3600))),
+    }
+
+def build_company_data(company_name, website_url, sitemap_metadata, insights, fingerprint):
+    # Document stored in the companies collection. The page URLs are only kept
+    # inside the compressed SitemapRecords (lastmod, changefreq, priority, hreflang),
+    # readers build the URL list from it when they need one
+    return {
+        'company_name': company_name,
+        'website_url': website_url,
+        'sitemap_metadata': sitemap_metadata,
+        'ai_insights': insights,
+        'sitemap_fingerprint': fingerprint,
+        'last_updated': time.time()
+    }
+
+def build_result(company_name, website_url, sitemap_urls, insights):
+    # Row returned to the client and written to the results CSV
+    return {
+        'Company': company_name,
+        'Website': website_url,
+        'Sitemap Complete': ", ".join(sitemap_urls),
+        # The joined string is for display, exports read the list since URLs may contain ", "
+        'Sitemap URLs': sitemap_urls,
+        'Insight from Prompt': insights
+    }
+
+# Counters for one stage, read by /health and the worker CLI
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def start(self, count=1):
+        with self._lock:
+            self.in_flight += count
+
+    def finish(self, count=1, error=False):
+        with self._lock:
+            self.in_flight -= count
+            self.processed += count
+            if error:
+                self.errors += count
+
+    def snapshot(self, queue_depth=None):
+        with self._lock:
+            stats = {
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'processed': self.processed,
+                'errors': self.errors,
+            }
+        if queue_depth is not None:
+            stats['queue_depth'] = queue_depth
+        return stats
+
+# Scrape -> AI -> store, each stage with its own workers, connected by bounded
+# queues. A slow AI call only holds an AI worker, scraping keeps going until
+# the queue in front of the AI stage fills up.
+class Pipeline:
+    def __init__(self, job_store, scrape_workers=20, scrape_processes=0, ai_workers=4,
+                 store_batch_size=20, store_flush_interval=2.0, queue_size=100, poll_interval=0.5, ai_batch_wait=0.2,
+                 freshness_window=7 * 24 * 3600):
+        self.job_store = job_store
+        self.scrape_workers = scrape_workers
+        self.scrape_processes = scrape_processes
+        self.ai_workers = ai_workers
+        self.poll_interval = poll_interval
+        self.ai_batch_wait = ai_batch_wait
+        self.freshness_window = freshness_window
+
+        self.ai_queue = queue.Queue(maxsize=queue_size)
+        self.store_queue = queue.Queue(maxsize=queue_size)
+
+        self.scrape_stats = StageStats('scrape', scrape_workers)
+        self.ai_stats = StageStats('ai', ai_workers)
+        self.store_stats = StageStats('store', 1)
+
+        # Outcomes of incremental jobs: fresh (nothing redone), unchanged
+        # (scraped, AI skipped), changed and new (analyzed in full)
+        self.incremental_stats = {'fresh': 0, 'unchanged': 0, 'changed': 0, 'new': 0}
+        self._incremental_lock = threading.Lock()
+
+        # Jobs for the same site (by normalized host) that are scraped at the
+        # same time share one extraction
+        self._scrapes = {}
+        self._scrapes_lock = threading.Lock()
+        self.shared_scrapes = 0
+
+        # Finished documents are written to MongoDB in batches behind the pipeline
+        self.company_writer = WriteBehindBuffer(max_size=store_batch_size, flush_interval=store_flush_interval)
+
+        self._stopping = threading.Event()
+        self._threads = []
+        self._stage_threads = {'scrape': [], 'ai': [], 'store': []}
+        self._scrape_pool = None
+
+    def start(self):
+        # Set up the AI client in the background so the first job doesn't wait for it
+        if os.getenv('AI_WARM_UP', '1') == '1':
+            threading.Thread(target=ai_processor.warm_up, daemon=True).start()
+
+        # Parsing is CPU-bound, so scraping can optionally run in worker processes.
+        # They are not forked from this process: its many threads may hold locks
+        # (connections, metrics, HTTP cache) that a forked child would never see released.
+        if self.scrape_processes > 0:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._scrape_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.scrape_processes,
+                mp_context=multiprocessing.get_context(start_method)
+            )
+
+        metrics.register_collector(self._collect_metrics)
+
+        for _ in range(self.scrape_workers):
+            self._spawn(self._scrape_worker, 'scrape')
+        for _ in range(self.ai_workers):
+            self._spawn(self._ai_worker, 'ai')
+        self._spawn(self._store_worker, 'store')
+
+    def _spawn(self, target, stage):
+        t = threading.Thread(target=target, daemon=True)
+        t.start()
+        self._threads.append(t)
+        self._stage_threads[stage].append(t)
+
+    def stop(self, timeout=10):
+        # Let the stages drain what they already hold, then flush storage
+        self._stopping.set()
+        for t in self._threads:
+            t.join(timeout)
+        if self._scrape_pool is not None:
+            self._scrape_pool.shutdown(wait=False, cancel_futures=True)
+        self.company_writer.close()
+
+    def alive_workers(self):
+        return sum(1 for t in self._threads if t.is_alive())
+
+    def dead_stages(self):
+        # Stages that were started with workers but have none left running
+        return [
+            stage for stage, threads in self._stage_threads.items()
+            if threads and not any(t.is_alive() for t in threads)
+        ]
+
+    def stats(self):
+        return {
+            'scrape': self.scrape_stats.snapshot(),
+            'ai': self.ai_stats.snapshot(self.ai_queue.qsize()),
+            'store': self.store_stats.snapshot(self.store_queue.qsize()),
+            'writes': self.company_writer.snapshot(),
+            'incremental': self._incremental_snapshot(),
+            'shared_scrapes': self.shared_scrapes,
+        }
+
+    def _incremental_snapshot(self):
+        with self._incremental_lock:
+            return dict(self.incremental_stats)
+
+    def _count_incremental(self, outcome):
+        with self._incremental_lock:
+            self.incremental_stats[outcome] += 1
+
+    def _collect_metrics(self):
+        # Per-stage gauges and counters, exported when /metrics is scraped
+        stats = self.stats()
+        stages = ('scrape', 'ai', 'store')
+        return [
+            ('pipeline_stage_in_flight', 'gauge', 'Items currently being worked on per stage',
+             [({'stage': stage}, stats[stage]['in_flight']) for stage in stages]),
+            ('pipeline_stage_queue_depth', 'gauge', 'Items waiting in front of a stage',
+             [({'stage': stage}, stats[stage].get('queue_depth')) for stage in stages]),
+            ('pipeline_stage_workers', 'gauge', 'Worker threads per stage',
+             [({'stage': stage}, stats[stage]['workers']) for stage in stages]),
+            ('pipeline_stage_processed_total', 'counter', 'Items finished per stage',
+             [({'stage': stage}, stats[stage]['processed']) for stage in stages]),
+            ('pipeline_stage_errors_total', 'counter', 'Items that failed per stage',
+             [({'stage': stage}, stats[stage]['errors']) for stage in stages]),
+            ('db_write_pending', 'gauge', 'Company documents waiting in the write-behind buffer',
+             [({}, stats['writes']['pending'])]),
+            ('pipeline_incremental_total', 'counter', 'Incremental jobs by outcome',
+             [({'outcome': outcome}, count) for outcome, count in stats['incremental'].items()]),
+            ('pipeline_shared_scrapes_total', 'counter', 'Jobs that reused a concurrent extraction of the same site',
+             [({}, stats['shared_scrapes'])]),
+        ]
+
+    def _put(self, target_queue, item):
+        # Blocks while the next stage is full (backpressure)
+        while True:
+            try:
+                target_queue.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                # Unclaimed work is requeued by the job store after a restart
+                if self._stopping.is_set():
+                    return False
+
+    def _complete_job(self, job_id, result):
+        try:
+            self.job_store.complete(job_id, result)
+        except Exception as e:
+            # The job stays claimed, the janitor requeues it after the visibility timeout
+            print(f"Worker error completing job {job_id}: {str(e)}")
+
+    def _fail_job(self, job_id, message):
+        try:
+            self.job_store.fail(job_id, message)
+        except Exception as e:
+            # The job stays claimed, the janitor requeues it after the visibility timeout
+            print(f"Worker error failing job {job_id}: {str(e)}")
+
+    def _scrape_worker(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.job_store.claim()
+            except Exception as e:
+                # A transient job store error must not end the worker, try again shortly
+                print(f"Worker error claiming a job: {str(e)}")
+                time.sleep(self.poll_interval * 5)
+                continue
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            job_id, payload = job
+            company_name = payload['company_name']
+            website_url = payload['website_url']
+
+            previous = None
+            if payload.get('incremental'):
+                previous = self._previous_analysis(company_name, website_url)
+                if previous is not None and time.time() - previous.get('last_updated', 0) < self.freshness_window:
+                    # Analyzed recently, reuse the stored result without scraping
+                    self._count_incremental('fresh')
+                    self._complete_job(job_id, build_result(
+                        company_name, website_url, company_urls(previous), previous['ai_insights']
+                    ))
+                    continue
+
+            self.scrape_stats.start()
+            started = time.time()
+            try:
+                records = self._scrape(website_url)
+            except Exception as e:
+                print(f"Worker error scraping {company_name}: {str(e)}")
+                self.scrape_stats.finish(error=True)
+                self._fail_job(job_id, str(e))
+                continue
+            self.scrape_stats.finish()
+            metrics.stage_seconds.labels('scrape').observe(time.time() - started)
+
+            # Only the compressed table travels down the pipeline, the URL strings
+            # are built again where a stage needs them
+            fingerprint = sitemap_fingerprint(records.urls())
+            url_count = len(records)
+            sitemap_metadata = records.to_bytes()
+            del records
+
+            if payload.get('incremental'):
+                if previous is not None and previous.get('sitemap_fingerprint') == fingerprint:
+                    # Same URL set as last time, keep the stored insights and skip the AI stage
+                    self._count_incremental('unchanged')
+                    self._put(self.store_queue, (job_id, company_name, website_url, sitemap_metadata, previous['ai_insights'], fingerprint))
+                    continue
+                self._count_incremental('changed' if previous is not None else 'new')
+
+            self._put(self.ai_queue, (job_id, company_name, website_url, sitemap_metadata, url_count, fingerprint))
+
+    def _scrape(self, website_url):
+        host = normalize_host(website_url)
+        with self._scrapes_lock:
+            future = self._scrapes.get(host)
+            owner = future is None
+            if owner:
+                future = self._scrapes[host] = concurrent.futures.Future()
+            else:
+                self.shared_scrapes += 1
+        if not owner:
+            return future.result()
+
+        try:
+            if self._scrape_pool is not None:
+                records = self._scrape_pool.submit(extract_sitemap_records, website_url).result()
+            else:
+                records = extract_sitemap_records(website_url)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(records)
+            return records
+        finally:
+            with self._scrapes_lock:
+                self._scrapes.pop(host, None)
+
+    def _previous_analysis(self, company_name, website_url):
+        # Stored result for the same company and site, or for the same site
+        # listed under another name, if it can be reused
+        try:
+            previous = get_company_data(company_name)
+            if previous is None or not same_site(previous.get('website_url'), website_url):
+                previous = get_company_by_website(website_url)
+        except Exception as e:
+            print(f"Error looking up previous analysis for {company_name}: {str(e)}")
+            return None
+        if previous is None or not same_site(previous.get('website_url'), website_url):
+            return None
+        insights = previous.get('ai_insights')
+        if not insights or insights.startswith(AI_ERROR_PREFIX):
+            return None
+        return previous
+
+    def _take_ai_batch(self, first):
+        # Small sitemaps wait briefly for others so they can share one AI request
+        items = [first]
+        if not ai_processor.ai_batching or not ai_processor.is_batchable(first[4]):
+            return items
+
+        linger_until = time.time() + self.ai_batch_wait
+        while len(items) < ai_processor.ai_batch_size:
+            remaining = linger_until - time.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.ai_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _ai_worker(self):
+        while not (self._stopping.is_set() and self.ai_queue.empty()):
+            try:
+                first = self.ai_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+
+            items = self._take_ai_batch(first)
+            self.ai_stats.start(len(items))
+            started = time.time()
+            try:
+                # Most recently modified pages first, so they make it into the AI prompt
+                if len(items) == 1:
+                    insights = [analyze_sitemap_with_ai(first[1], urls_from_bytes(first[3]))]
+                else:
+                    insights = analyze_sitemaps_batch([(item[1], urls_from_bytes(item[3])) for item in items])
+            except Exception as e:
+                # The row is still stored and exported, with the error in place of the insight
+                for _, company_name, _, _, _, _ in items:
+                    print(f"Worker error analyzing {company_name}: {str(e)}")
+                insights = [f"{AI_ERROR_PREFIX}{str(e)}"] * len(items)
+                self.ai_stats.finish(len(items), error=True)
+            else:
+                # A batch reports each company's own failure as error text
+                failed = sum(1 for insight in insights if insight.startswith(AI_ERROR_PREFIX))
+                self.ai_stats.finish(len(items) - failed)
+                if failed:
+                    self.ai_stats.finish(failed, error=True)
+            metrics.stage_seconds.labels('ai').observe(time.time() - started)
+
+            for (job_id, company_name, website_url, sitemap_metadata, _, fingerprint), insight in zip(items, insights):
+                self._put(self.store_queue, (job_id, company_name, website_url, sitemap_metadata, insight, fingerprint))
+
+    def _store_worker(self):
+        while not (self._stopping.is_set() and self.store_queue.empty()):
+            try:
+                job_id, company_name, website_url, sitemap_metadata, insights, fingerprint = self.store_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+
+            self.store_stats.start()
+            started = time.time()
+            try:
+                self.company_writer.add(build_company_data(company_name, website_url, sitemap_metadata, insights, fingerprint))
+
+                # Results are served from the job store, the database write happens behind it
+                self.job_store.complete(job_id, build_result(company_name, website_url, urls_from_bytes(sitemap_metadata), insights))
+            except Exception as e:
+                # This is the only store thread, one bad write must not stop it
+                print(f"Worker error storing {company_name}: {str(e)}")
+                self.store_stats.finish(error=True)
+                self._fail_job(job_id, str(e))
+                continue
+            self.store_stats.finish()
+            metrics.stage_seconds.labels('store').observe(time.time() - started)
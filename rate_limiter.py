@@ -0,0 +1,124 @@
+import collections
+import threading
+import time
+
+class RateLimitTimeout(Exception):
+    pass
+
+def estimate_tokens(text):
+    # Rough count used for the tokens-per-minute budget, about 4 characters a token
+    return max(1, len(text) // 4)
+
+# Token buckets for requests and tokens per minute, shared by every thread in
+# the process. Callers are served first come, first served, and the refill rate
+# is halved on a 429 and recovers a step at a time on success (AIMD).
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute, burst_seconds=10,
+                 min_fraction=0.1, recovery_step=0.05, default_backoff=5):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_fraction = min_fraction
+        self.recovery_step = recovery_step
+        self.default_backoff = default_backoff
+
+        # Bucket sizes allow a short burst, never less than one request
+        self.request_capacity = max(1.0, requests_per_minute * burst_seconds / 60)
+        self.token_capacity = max(1.0, tokens_per_minute * burst_seconds / 60)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+
+        self.rate_fraction = 1.0
+        self._blocked_until = 0
+        self._updated = time.monotonic()
+        self._waiters = collections.deque()
+        self._cond = threading.Condition()
+        self.stats = {'acquired': 0, 'timed_out': 0, 'throttled': 0, 'wait_seconds': 0.0}
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if elapsed <= 0:
+            return
+        self._requests = min(self.request_capacity,
+                             self._requests + elapsed * self.requests_per_minute / 60 * self.rate_fraction)
+        self._tokens = min(self.token_capacity,
+                           self._tokens + elapsed * self.tokens_per_minute / 60 * self.rate_fraction)
+
+    def _time_until_available(self, tokens, now):
+        if now < self._blocked_until:
+            return self._blocked_until - now
+
+        wait = 0
+        if self._requests < 1:
+            wait = (1 - self._requests) / (self.requests_per_minute / 60 * self.rate_fraction)
+        if self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) / (self.tokens_per_minute / 60 * self.rate_fraction))
+        return wait
+
+    def acquire(self, tokens=1, timeout=None):
+        # A single request larger than the bucket would never fit
+        tokens = min(tokens, self.token_capacity)
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        ticket = object()
+
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+
+                    # Only the caller at the head of the line may take from the buckets
+                    if self._waiters[0] is ticket:
+                        self._refill(now)
+                        wait = self._time_until_available(tokens, now)
+                        if wait <= 0:
+                            self._requests -= 1
+                            self._tokens -= tokens
+                            self.stats['acquired'] += 1
+                            self.stats['wait_seconds'] += now - started
+                            return True
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self.stats['timed_out'] += 1
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+    def throttled(self, retry_after=None):
+        # 429 or quota error: halve the rate, empty the buckets and pause everyone
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate_fraction = max(self.min_fraction, self.rate_fraction / 2)
+            self._requests = 0
+            self._tokens = 0
+            pause = retry_after if retry_after is not None else self.default_backoff
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self.stats['throttled'] += 1
+            self._cond.notify_all()
+
+    def succeeded(self):
+        # Additive increase back towards the configured rate
+        if self.rate_fraction >= 1.0:
+            return
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate_fraction = min(1.0, self.rate_fraction + self.recovery_step)
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['rate_fraction'] = round(self.rate_fraction, 3)
+            stats['waiting'] = len(self._waiters)
+            stats['requests_per_minute'] = self.requests_per_minute
+            stats['tokens_per_minute'] = self.tokens_per_minute
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        return stats
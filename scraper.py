@@ -1,4 +1,6 @@
+import os
 import requests
+import urllib3
 from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 import random
@@ -7,297 +9,887 @@ import time
 import threading
 import concurrent.futures
 import itertools
+import asyncio
+import contextlib
+import functools
+import weakref
+import socket
+import re
+import zlib
+import heapq
+import datetime
+from xml.sax.saxutils import unescape
 
-# Add Session for connecting pooling
-# Create a connection pool
-session = requests.Session()
-adapter = requests.adapters.HTTPAdapter(
-    pool_connections=10,
-    pool_maxsize=10,
-    max_retries=3
+from http_cache import HTTPCache
+from connections import build_session, install_dns_cache, get_connection_stats
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from sitemap_records import SitemapRecords
+from url_utils import canonical_url, normalize_host
+import metrics
+
+# On-disk conditional-request cache for robots.txt and sitemap fetches
+http_cache = None
+if os.getenv('HTTP_CACHE_ENABLED', '1') == '1':
+    http_cache = HTTPCache(
+        os.getenv('HTTP_CACHE_PATH', 'http_cache.sqlite3'),
+        max_bytes=int(os.getenv('HTTP_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+        ttl=int(os.getenv('HTTP_CACHE_TTL', str(14 * 24 * 3600)))
+    )
+
+# Concurrency limits for the discovery engine
+max_concurrency = int(os.getenv('SCRAPER_MAX_CONCURRENCY', '32'))
+per_host_concurrency = int(os.getenv('SCRAPER_PER_HOST_CONCURRENCY', '4'))
+
+# Keep-alive session with a connection pool per host, sized from the concurrency
+# limits above so probing one domain reuses the same few connections
+session = build_session(max_hosts=max_concurrency, per_host_connections=per_host_concurrency)
+
+# Connection failures are retried by _get, never past the extraction deadline
+request_retries = int(os.getenv('SCRAPER_REQUEST_RETRIES', '3'))
+
+# Timeout of one request, shortened near the end of an extraction's budget
+request_timeout_seconds = float(os.getenv('SCRAPER_REQUEST_TIMEOUT', '2'))
+
+# Whether the current fetch thread's request got the full timeout. A request
+# cut short by the deadline that then times out says nothing about the host.
+_fetch_state = threading.local()
+
+# Cache DNS results so repeated probes to a host skip the lookup
+install_dns_cache(ttl=int(os.getenv('SCRAPER_DNS_TTL', '300')))
+
+# Per-host circuit breakers: once most requests to a host fail to connect or
+# time out, further extractions for it return straight away instead of
+# spending their whole budget on a dead domain
+host_breakers = CircuitBreakerRegistry(
+    failure_rate_threshold=float(os.getenv('SCRAPER_BREAKER_FAILURE_RATE', '0.5')),
+    minimum_calls=int(os.getenv('SCRAPER_BREAKER_MIN_CALLS', '5')),
+    window_seconds=int(os.getenv('SCRAPER_BREAKER_WINDOW', '120')),
+    reset_timeout=int(os.getenv('SCRAPER_BREAKER_RESET_TIMEOUT', '300')),
+    half_open_max_calls=1
+)
+
+def get_host_breaker_stats():
+    # Only hosts that are currently open or half-open are listed
+    return host_breakers.snapshot(include_closed=False)
+
+# Blocking HTTP calls from every extraction share one bounded executor
+fetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max_concurrency,
+    thread_name_prefix='sitemap-fetch'
 )
-session.mount('http://', adapter)
-session.mount('https://', adapter)
+
+# Background event loop that drives the discovery coroutines for sync callers
+_loop = None
+_loop_lock = threading.Lock()
+
+# Semaphores are bound to an event loop, so keep one set per loop
+_loop_limits = weakref.WeakKeyDictionary()
+
+# List of common user agents to rotate
+user_agents = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15',
+]
+
+# Sitemaps are streamed and parsed incrementally in chunks of this size
+stream_chunk_size = 16 * 1024
+
+# Maximum number of page URLs kept from a single urlset, so one huge child
+# sitemap can't use up the whole site budget on its own
+max_urls_per_sitemap = int(os.getenv('SITEMAP_MAX_URLS_PER_SITEMAP', '100'))
+
+# Per-site budgets for walking nested sitemap indexes
+sitemap_max_urls = int(os.getenv('SITEMAP_MAX_URLS', '500'))
+sitemap_max_bytes = int(os.getenv('SITEMAP_MAX_BYTES', str(20 * 1024 * 1024)))  # bytes read off the wire
+sitemap_max_fetches = int(os.getenv('SITEMAP_MAX_FETCHES', '50'))
+sitemap_max_depth = int(os.getenv('SITEMAP_MAX_DEPTH', '3'))
+
+# Child sitemap names that usually list the pages worth analysing, and the
+# ones that mostly list taxonomy, media and other low value pages
+PREFERRED_SITEMAP_WORDS = ('page', 'post', 'product', 'service', 'solution', 'article', 'blog', 'news', 'main')
+LOW_VALUE_SITEMAP_WORDS = ('tag', 'author', 'archive', 'attachment', 'image', 'video', 'media', 'comment', 'user', 'feed')
+YEAR_PATTERN = re.compile(r'(?<!\d)(19|20)\d{2}(?!\d)')
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+XHTML_NS = '{http://www.w3.org/1999/xhtml}'
+
+# Fields kept from each <url>/<sitemap> entry, namespaced or not
+SITEMAP_FIELDS = {}
+for _field in ('loc', 'lastmod', 'changefreq', 'priority'):
+    SITEMAP_FIELDS[SITEMAP_NS + _field] = SITEMAP_FIELDS[_field] = _field
+LOC_PATTERN = re.compile(rb'<loc>(.*?)</loc>', re.S)
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Common sitemap paths to try
+sitemap_paths = [
+    '/sitemap.xml',
+    '/sitemaps.xml',
+    '/sitemap_index.xml',
+    '/sitemap-index.xml',
+    '/wp-sitemap.xml',
+    '/site-map.xml',
+    '/sitemap.php',
+    '/sitemap.txt',
+    '/sitemap/sitemap.xml'
+]
+
+# Counters for cancelled extractions and the blocking fetches they left behind
+_cancellation_lock = threading.Lock()
+cancellation_stats = {
+    'extractions_timed_out': 0,  # extractions that ran out of budget
+    'requests_aborted': 0,  # in-flight responses closed by a cancellation
+    'orphaned_fetches': 0,  # fetches still running for an already cancelled extraction
+}
+
+class ExtractionCancelled(Exception):
+    pass
+
+# Time budget shared by everything one extraction starts. Cancelling it closes
+# in-flight responses and stops new requests and recursion.
+class Deadline:
+    def __init__(self, max_total_time, start_time=None):
+        self.start_time = start_time if start_time is not None else time.time()
+        self.max_total_time = max_total_time
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._responses = set()
+        self._active_fetches = 0
+
+    def remaining(self):
+        return self.start_time + self.max_total_time - time.time()
+
+    def used(self, fraction):
+        # True once the given fraction of the budget has been spent
+        return self.cancelled or time.time() - self.start_time >= self.max_total_time * fraction
+
+    def request_timeout(self, default=None):
+        if default is None:
+            default = request_timeout_seconds
+        remaining = self.remaining()
+        if self.cancelled or remaining <= 0:
+            raise ExtractionCancelled()
+        return min(default, remaining)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            responses = list(self._responses)
+            self._responses.clear()
+            orphaned = self._active_fetches
+
+        for response in responses:
+            _abort_response(response)
+
+        with _cancellation_lock:
+            cancellation_stats['requests_aborted'] += len(responses)
+            cancellation_stats['orphaned_fetches'] += orphaned
+
+    @contextlib.contextmanager
+    def fetch(self, response=None):
+        # Track a blocking fetch so a cancellation can abort it
+        with self._lock:
+            if self.cancelled:
+                raise ExtractionCancelled()
+            self._active_fetches += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._active_fetches -= 1
+                was_cancelled = self.cancelled
+            if was_cancelled:
+                with _cancellation_lock:
+                    cancellation_stats['orphaned_fetches'] -= 1
+
+    def register(self, response):
+        with self._lock:
+            if self.cancelled:
+                response.close()
+                raise ExtractionCancelled()
+            self._responses.add(response)
+
+    def unregister(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def guard(self, chunks):
+        # Stop reading a body as soon as the budget is gone
+        for chunk in chunks:
+            if self.cancelled:
+                raise ExtractionCancelled()
+            yield chunk
+
+def _abort_response(response):
+    # Shut the socket down so a read blocked in a fetch thread returns right away;
+    # closing the response here would wait for that read to finish
+    connection = getattr(response.raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        # http.client drops connection.sock once the server says it will close,
+        # the body is then read straight from the socket behind the file object
+        body = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(body, 'raw', None), '_sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def get_cancellation_stats():
+    with _cancellation_lock:
+        return dict(cancellation_stats)
+
+def _collect_metrics():
+    # Existing scraper counters, exported when /metrics is scraped
+    cancellation = get_cancellation_stats()
+    connections = get_connection_stats()
+    hosts = host_breakers.snapshot(include_closed=False)
+
+    families = [
+        ('scraper_extractions_timed_out_total', 'counter', 'Extractions that ran out of their time budget',
+         [({}, cancellation['extractions_timed_out'])]),
+        ('scraper_requests_aborted_total', 'counter', 'In-flight responses closed by a cancellation',
+         [({}, cancellation['requests_aborted'])]),
+        ('scraper_orphaned_fetches', 'gauge', 'Fetches still running for an already cancelled extraction',
+         [({}, cancellation['orphaned_fetches'])]),
+        ('scraper_requests_total', 'counter', 'HTTP requests made by the scraper',
+         [({}, connections['requests'])]),
+        ('scraper_connections_total', 'counter', 'Requests by whether they reused a pooled connection',
+         [({'result': 'reused'}, connections['pool_hits']), ({'result': 'new'}, connections['pool_misses'])]),
+        ('scraper_dns_lookups_total', 'counter', 'DNS lookups by cache result',
+         [({'result': 'hit'}, connections['dns_hits']), ({'result': 'miss'}, connections['dns_misses'])]),
+        ('scraper_host_breakers', 'gauge', 'Per-host circuit breakers by state',
+         [({'state': state}, count) for state, count in hosts['states'].items()]),
+        ('scraper_host_breaker_trips_total', 'counter', 'Times a per-host circuit breaker opened',
+         [({}, hosts['opened'])]),
+    ]
+    if http_cache is not None:
+        cache_stats = dict(http_cache.stats)
+        families.append(('http_cache_responses_total', 'counter', 'Conditional requests by cache outcome',
+                         [({'result': 'revalidated'}, cache_stats['revalidated']),
+                          ({'result': 'miss'}, cache_stats['misses'])]))
+        families.append(('http_cache_evictions_total', 'counter', 'Entries evicted from the HTTP cache',
+                         [({}, cache_stats['evicted'])]))
+    return families
+
+metrics.register_collector(_collect_metrics)
+
+def _get_loop():
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='sitemap-discovery', daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+def _reset_after_fork():
+    # Threads don't survive fork, so a child process (SCRAPE_PROCESSES) needs its
+    # own discovery loop and fetch executor
+    global _loop, _loop_lock, _loop_limits, fetch_executor
+    _loop = None
+    _loop_lock = threading.Lock()
+    _loop_limits = weakref.WeakKeyDictionary()
+    fetch_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_concurrency,
+        thread_name_prefix='sitemap-fetch'
+    )
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _run_sync(coro, timeout=None):
+    # Run a coroutine on the shared discovery loop from a regular thread
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+@contextlib.asynccontextmanager
+async def _limit(host):
+    loop = asyncio.get_running_loop()
+    limits = _loop_limits.get(loop)
+    if limits is None:
+        limits = _loop_limits[loop] = {'global': asyncio.Semaphore(max_concurrency), 'hosts': {}}
+
+    # Per-host semaphores are reference counted so idle hosts don't accumulate
+    host_entry = limits['hosts'].get(host)
+    if host_entry is None:
+        host_entry = limits['hosts'][host] = [asyncio.Semaphore(per_host_concurrency), 0]
+    host_entry[1] += 1
+    try:
+        # Wait for the host slot first so we don't hold a global slot while queued
+        async with host_entry[0]:
+            async with limits['global']:
+                yield
+    finally:
+        host_entry[1] -= 1
+        if host_entry[1] == 0:
+            limits['hosts'].pop(host, None)
+
+async def _run_blocking(host, deadline, func, *args):
+    # Run a blocking request on the shared executor within the concurrency limits
+    breaker = host_breakers.get(host)
+    async with _limit(host):
+        if deadline.cancelled:
+            raise ExtractionCancelled()
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker for {host} is open")
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(fetch_executor, functools.partial(_tracked_call, deadline, func, *args))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # Connections we aborted ourselves, and timeouts the deadline made
+            # shorter than usual, say nothing about the host
+            if deadline.cancelled or getattr(e, 'deadline_shortened', False):
+                breaker.release()
+            else:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        # Any HTTP response, even an error status, means the host is up
+        breaker.record_success()
+        return result
+
+def _tracked_call(deadline, func, *args):
+    _fetch_state.full_timeout = True
+    with deadline.fetch():
+        try:
+            return func(*args, deadline)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if _is_timeout(e) and not _fetch_state.full_timeout:
+                e.deadline_shortened = True
+            raise
+
+def _is_timeout(error):
+    # Timed out connecting, waiting for headers, or reading the body
+    if isinstance(error, requests.Timeout):
+        return True
+    return bool(error.args) and isinstance(error.args[0], urllib3.exceptions.ReadTimeoutError)
+
+def _build_headers():
+    return {
+        'User-Agent': random.choice(user_agents),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+    }
 
 def extract_sitemap(url, max_total_time=20):
+    # Page URLs only, in the order they were discovered
+    return list(extract_sitemap_records(url, max_total_time))
+
+def extract_sitemap_records(url, max_total_time=20):
+    # Synchronous wrapper around the async discovery engine
+    try:
+        return _run_sync(extract_sitemap_records_async(url, max_total_time), timeout=max_total_time + 5)
+    except concurrent.futures.TimeoutError:
+        print(f"Extraction timed out after {max_total_time} seconds")
+        return SitemapRecords()
+
+async def extract_sitemap_async(url, max_total_time=20):
+    return list(await extract_sitemap_records_async(url, max_total_time))
+
+async def extract_sitemap_records_async(url, max_total_time=20):
+    # Page URLs of a site with their sitemap metadata (lastmod, changefreq,
+    # priority, hreflang alternates) in a SitemapRecords table
 
     # Track start time to enforce total time limit
-    start_time = time.time()
-    
-    # Use a list that can be accessed from worker thread
-    all_urls = []
-    
-    # List of common user agents to rotate
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15',
-    ]
-    
+    deadline = Deadline(max_total_time)
+
+    records = SitemapRecords()
+
     # Ensure URL has proper schema
     if not url.startswith(('http://', 'https://')):
         url = 'https://' + url
-    
+
     # Get the base domain
     parsed_url = urlparse(url)
     base_domain = f"{parsed_url.scheme}://{parsed_url.netloc}"
-    
-    # Common sitemap paths to try
-    sitemap_paths = [
-        '/sitemap.xml',
-        '/sitemaps.xml',
-        '/sitemap_index.xml',
-        '/sitemap-index.xml',
-        '/wp-sitemap.xml',
-        '/site-map.xml',
-        '/sitemap.php',
-        '/sitemap.txt',
-        '/sitemap/sitemap.xml'
-    ]
-    
-    headers = {
-        'User-Agent': random.choice(user_agents),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': 'close',  # Don't keep connections open
-    }
-    
-    # Track URLs we've seen to avoid duplicates
-    seen_urls = set()
-    
-    # Use a thread to enforce hard timeout
-    def extraction_worker():
-        nonlocal all_urls, seen_urls
-        sitemap_found = False
-        
+
+    # Skip hosts that recently failed to respond at all
+    host_breaker = host_breakers.get(parsed_url.netloc)
+    if not host_breaker.available():
+        print(f"Skipping {base_domain}, circuit breaker is open")
+        return records
+
+    headers = _build_headers()
+
+    # One frontier for the whole site: robots.txt sitemaps and the probed paths
+    # share its URL, byte and fetch budgets, and a sitemap is fetched only once
+    frontier = SitemapFrontier()
+
+    async def extraction_worker():
         # First try robots.txt to find sitemap with shorter timeout
         try:
             robots_url = f"{base_domain}/robots.txt"
-            response = requests.get(robots_url, timeout=2, headers=headers)
-            
-            if response.status_code == 200:
-                # Look for Sitemap: directive in robots.txt
-                for line in response.text.split('\n'):
-                    if line.lower().startswith('sitemap:'):
-                        sitemap_url = line.split(':', 1)[1].strip()
-                        print(f"Found sitemap in robots.txt: {sitemap_url}")
-                        
-                        # Process this sitemap
-                        urls = process_sitemap(sitemap_url, headers, start_time, max_total_time)
-                        if urls:
-                            # Add only unique URLs
-                            for url in urls:
-                                if url not in seen_urls:
-                                    all_urls.append(url)
-                                    seen_urls.add(url)
-                            sitemap_found = True
-                            return  # Early return if we found URLs
+            robots_sitemaps = await _run_blocking(parsed_url.netloc, deadline, _fetch_robots_sitemaps, robots_url, headers)
+
+            for sitemap_url in robots_sitemaps:
+                print(f"Found sitemap in robots.txt: {sitemap_url}")
+
+            if robots_sitemaps:
+                found = await crawl_sitemaps_async(robots_sitemaps, headers, deadline, frontier)
+                if found:
+                    records.merge(found, limit=sitemap_max_urls)
+                    return  # Early return if we found URLs
+        except (ExtractionCancelled, CircuitOpenError):
+            return
         except Exception as e:
             print(f"Error checking robots.txt: {str(e)}")
-        
-        # If no sitemap found in robots.txt, try common locations
-        if not sitemap_found:
-            # USE CONCURRENT PROCESSING
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                future_to_path = {
-                    executor.submit(try_sitemap_path, base_domain, path, headers, start_time, max_total_time): path
-                    for path in sitemap_paths
-                }
-
-                for future in concurrent.futures.as_completed(future_to_path):
-                    path = future_to_path[future]
-                    try:
-                        urls = future.result()
-                        if urls:
-                            # Add only unique URLs
-                            for url in urls:
-                                if url not in seen_urls:
-                                    all_urls.append(url)
-                                    seen_urls.add(url)
-                            sitemap_found = True
-                            break  # Early break if we found URLs
-                    except Exception as e:
-                        print(f"Error checking sitemap path {path}: {str(e)}")
-       
+
+        # If no sitemap found in robots.txt, probe the common locations concurrently.
+        # They are seeds of one crawl, so two paths that lead to the same index
+        # fetch it once and everything stays within the site budgets.
+        if not deadline.used(0.7):  # 70% of allowed time
+            for path in sitemap_paths:
+                print(f"Trying sitemap at: {base_domain}{path}")
+            try:
+                found = await crawl_sitemaps_async(
+                    [f"{base_domain}{path}" for path in sitemap_paths], headers, deadline, frontier
+                )
+            except ExtractionCancelled:
+                return
+            if found:
+                records.merge(found, limit=sitemap_max_urls)
+                return  # Early return if we found URLs
+            # The probes tripped the breaker, the host is not answering
+            if not host_breaker.available():
+                print(f"Giving up on {base_domain}, circuit breaker is open")
+                return
+
         # If still no sitemap found, fall back to HTML scraping (but only if we have time)
-        if not sitemap_found and time.time() - start_time < max_total_time * 0.8:  # 80% of allowed time
+        if not deadline.used(0.8):  # 80% of allowed time
             try:
                 print(f"No XML sitemap found, falling back to HTML scraping for: {base_domain}")
-                response = session.get(base_domain, timeout=2, headers=headers)
-                
-                # Parse HTML
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Find all links (limiting to first 100 to be quick)
-                link_count = 0
-                for a_tag in soup.find_all('a', href=True):
-                    href = a_tag['href']
-                    
-                    # Skip empty links, fragments, and javascript links
-                    if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')):
-                        continue
-                    
-                    # Convert relative URLs to absolute
-                    full_url = urljoin(base_domain, href)
-                    
-                    # Only include links from the same domain
-                    if urlparse(full_url).netloc == parsed_url.netloc and full_url not in seen_urls:
-                        all_urls.append(full_url)
-                        seen_urls.add(full_url)
-                        link_count += 1
-                        if link_count >= 100:  # Limit to first 100 links for speed
-                            break
+                metrics.html_fallbacks.inc()
+                urls = await _run_blocking(parsed_url.netloc, deadline, _scrape_html_links, base_domain, parsed_url.netloc, headers)
+                records.add_urls(urls, limit=sitemap_max_urls)
+            except ExtractionCancelled:
+                pass
             except Exception as e:
                 print(f"Error with HTML fallback scraping {base_domain}: {str(e)}")
-    
-    # Helper Function
-    def try_sitemap_path(base_domain, path, headers, start_time, max_total_time):
-        # Check if we've already spent too much time
-        if time.time() - start_time >= max_total_time * 0.7:  # 70% of allowed time
-            return []
-        
-        sitemap_url = f"{base_domain}{path}"
-        print(f"Trying sitemap at: {sitemap_url}")
-
-        return process_sitemap(sitemap_url, headers, start_time, max_total_time)
-
-    # Create and start the worker thread
-    worker_thread = threading.Thread(target=extraction_worker)
-    worker_thread.daemon = True
-    worker_thread.start()
-    
-    # Wait for the worker to finish or timeout
-    worker_thread.join(max_total_time)
-    
-    # If thread is still alive after timeout, we need to return what we have
-    if worker_thread.is_alive():
+
+    # Enforce the total time limit, keeping whatever was found before it ran out
+    try:
+        await asyncio.wait_for(extraction_worker(), timeout=max_total_time)
+    except asyncio.TimeoutError:
         print(f"Extraction timed out after {max_total_time} seconds")
-    
-    # Return unique URLs, limited to 500 if there are too many
-    unique_urls = list(seen_urls)
-    if len(unique_urls) > 500:
-        print(f"Limiting results from {len(unique_urls)} to 500 URLs")
-        return unique_urls[:500]
-    return unique_urls
+        with _cancellation_lock:
+            cancellation_stats['extractions_timed_out'] += 1
+    finally:
+        # Abort whatever is still in flight (timed out, or probes that lost the race)
+        deadline.cancel()
+        metrics.extract_seconds.observe(time.time() - deadline.start_time)
+
+    # Unique URLs, every source above stops at the site budget
+    return records
+
+def _fetch_robots_sitemaps(robots_url, headers, deadline):
+    return _conditional_get(f"robots:{robots_url}", robots_url, headers, _parse_robots_sitemaps, deadline)
+
+def _parse_robots_sitemaps(response, deadline):
+    sitemap_urls = []
+    if response.status_code == 200:
+        # Look for Sitemap: directive in robots.txt
+        for line in response.text.split('\n'):
+            if line.lower().startswith('sitemap:'):
+                sitemap_urls.append(line.split(':', 1)[1].strip())
+    return sitemap_urls
+
+def _get(url, deadline, **kwargs):
+    # Every attempt checks the deadline first and gets a timeout capped by what
+    # is left of it. Only failures to connect are retried, a read timeout means
+    # the host is up but slow and another try would just wait again.
+    attempt = 0
+    while True:
+        try:
+            timeout = deadline.request_timeout()
+            _fetch_state.full_timeout = timeout >= request_timeout_seconds
+            return session.get(url, timeout=timeout, **kwargs)
+        except requests.exceptions.ConnectionError:
+            if attempt >= request_retries or deadline.cancelled:
+                raise
+            attempt += 1
+
+def _conditional_get(cache_key, url, headers, parse, deadline, stream=False, cacheable=None):
+    # Revalidate against the HTTP cache and reuse the parsed result on a 304
+    cached = http_cache.get(cache_key) if http_cache else None
+
+    request_headers = dict(headers)
+    if http_cache:
+        request_headers.update(http_cache.conditional_headers(cached))
+
+    # robots or sitemap, for the timing metrics
+    kind = cache_key.split(':', 1)[0]
+
+    # Use shorter timeout for individual requests, never past the deadline
+    with metrics.fetch_seconds.labels(kind).time():
+        response = _get(url, deadline, headers=request_headers, stream=stream)
+    deadline.register(response)
+    try:
+        if response.status_code == 304 and cached is not None:
+            http_cache.touch(cache_key)
+            return cached['payload']
+
+        with metrics.parse_seconds.labels(kind).time():
+            result = parse(response, deadline)
+        if http_cache:
+            http_cache.miss()
+            if response.status_code == 200 and (cacheable is None or cacheable(result)):
+                http_cache.put(
+                    cache_key,
+                    response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'),
+                    result
+                )
+        return result
+    finally:
+        # Closing a partially read response aborts the rest of the transfer
+        deadline.unregister(response)
+        response.close()
+
+def _scrape_html_links(base_domain, netloc, headers, deadline):
+    with metrics.fetch_seconds.labels('html').time():
+        response = _get(base_domain, deadline, headers=headers)
+
+    # Parse HTML
+    with metrics.parse_seconds.labels('html').time():
+        soup = BeautifulSoup(response.text, 'html.parser')
+
+    # Find all links (limiting to first 100 to be quick)
+    links = []
+    seen_links = set()
+    site_host = normalize_host(base_domain)
+    for a_tag in soup.find_all('a', href=True):
+        href = a_tag['href']
+
+        # Skip empty links, fragments, and javascript links
+        if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')):
+            continue
+
+        # Convert relative URLs to absolute
+        full_url = urljoin(base_domain, href)
+
+        # Only include links from the same site (www. or not), each page once
+        link_key = canonical_url(full_url)
+        if normalize_host(full_url) == site_host and link_key not in seen_links:
+            links.append(full_url)
+            seen_links.add(link_key)
+            if len(links) >= 100:  # Limit to first 100 links for speed
+                break
+    return links
+
+def _lastmod_age_days(lastmod):
+    # Days since a W3C datetime <lastmod>, None when missing or unparseable
+    if not lastmod:
+        return None
+    try:
+        modified = datetime.date.fromisoformat(lastmod.strip()[:10])
+    except ValueError:
+        return None
+    return max((datetime.date.today() - modified).days, 0)
+
+def _sitemap_priority(sitemap_url, lastmod=None):
+    # Higher is better: recently modified children first, then by name
+    name = urlparse(sitemap_url).path.lower().rsplit('/', 1)[-1]
+    score = 0.0
+    if any(word in name for word in PREFERRED_SITEMAP_WORDS):
+        score += 1
+    if any(word in name for word in LOW_VALUE_SITEMAP_WORDS):
+        score -= 2
+
+    age = _lastmod_age_days(lastmod)
+    if age is not None:
+        score -= min(age / 365, 5)
+    else:
+        # Date-split sitemaps (posts-2019.xml) without a lastmod, older years last
+        years = [int(match.group(0)) for match in YEAR_PATTERN.finditer(name)]
+        if years:
+            score -= min(max(datetime.date.today().year - max(years), 0), 5)
+    return score
+
+# Sitemaps still to fetch for one site, shallowest first and best first within
+# a depth, together with the site's URL, byte and fetch budgets
+class SitemapFrontier:
+    def __init__(self, max_urls=None, max_bytes=None, max_fetches=None, max_depth=None):
+        self.max_urls = max_urls if max_urls is not None else sitemap_max_urls
+        self.max_bytes = max_bytes if max_bytes is not None else sitemap_max_bytes
+        self.max_fetches = max_fetches if max_fetches is not None else sitemap_max_fetches
+        self.max_depth = max_depth if max_depth is not None else sitemap_max_depth
+
+        self.records = SitemapRecords()
+        self.fetches = 0
+        self.bytes_read = 0
+        self._seen_sitemaps = set()
+        self._queue = []  # (depth, -priority, order, sitemap URL)
+        self._order = itertools.count()
+        self._bytes_lock = threading.Lock()  # bytes are counted on the fetch threads
+
+    def push(self, sitemap_url, depth=0, lastmod=None):
+        key = canonical_url(sitemap_url)
+        if depth > self.max_depth or key in self._seen_sitemaps:
+            return
+        self._seen_sitemaps.add(key)
+        priority = _sitemap_priority(sitemap_url, lastmod)
+        heapq.heappush(self._queue, (depth, -priority, next(self._order), sitemap_url))
+
+    def pop(self):
+        depth, _, _, sitemap_url = heapq.heappop(self._queue)
+        self.fetches += 1
+        return sitemap_url, depth
+
+    def pending(self):
+        return bool(self._queue) and self.fetches < self.max_fetches and not self.exhausted()
+
+    def add_entries(self, entries):
+        self.records.add_entries(entries, limit=self.max_urls)
+
+    def take_bytes(self, count):
+        # Returns False once the site's byte budget is spent
+        with self._bytes_lock:
+            self.bytes_read += count
+            return self.bytes_read <= self.max_bytes
+
+    def exhausted(self):
+        return len(self.records) >= self.max_urls or self.bytes_read >= self.max_bytes
 
 def process_sitemap(sitemap_url, headers, start_time, max_total_time):
-    
-    # Check if we've already spent too much time
-    if time.time() - start_time >= max_total_time * 0.8:  # 80% of allowed time
+    # Synchronous wrapper around process_sitemap_async
+    deadline = Deadline(max_total_time, start_time)
+    try:
+        return _run_sync(process_sitemap_async(sitemap_url, headers, deadline), timeout=max(deadline.remaining(), 0))
+    except concurrent.futures.TimeoutError:
         return []
-        
-    urls = []
-    seen_urls = set()  # Track URLs we've seen to avoid duplicates
-    
+    finally:
+        deadline.cancel()
+
+async def process_sitemap_async(sitemap_url, headers, deadline):
+    return list(await crawl_sitemaps_async([sitemap_url], headers, deadline))
+
+async def crawl_sitemaps_async(sitemap_urls, headers, deadline, frontier=None):
+    # Walk the sitemaps and every index below them breadth first, best children
+    # first, until the site's budgets or the deadline run out
+
+    # Check if we've already spent too much time
+    if deadline.used(0.8):  # 80% of allowed time
+        return SitemapRecords()
+
+    if frontier is None:
+        frontier = SitemapFrontier()
+    for sitemap_url in sitemap_urls:
+        frontier.push(sitemap_url)
+
+    async def fetch(ticket, sitemap_url, depth):
+        result = await _run_blocking(
+            urlparse(sitemap_url).netloc, deadline, _fetch_sitemap, sitemap_url, headers, frontier
+        )
+        return ticket, depth, result
+
+    # Fetches finish in any order, but their URLs are taken in priority order
+    # so a fast low value sitemap can't fill the budget ahead of a better one
+    tickets = itertools.count()
+    finished = {}  # ticket -> (depth, result), None for a failed fetch
+    next_ticket = 0
+
+    def take_finished(flush=False):
+        nonlocal next_ticket
+        while finished and (flush or next_ticket in finished):
+            if next_ticket in finished:
+                entry = finished.pop(next_ticket)
+                if entry is not None:
+                    depth, (page_entries, child_sitemaps) = entry
+                    frontier.add_entries(page_entries)
+                    for child_url, lastmod in child_sitemaps:
+                        frontier.push(child_url, depth + 1, lastmod)
+            next_ticket += 1
+
+    running = {}
     try:
-        # Use shorter timeout for individual requests
-        response = session.get(sitemap_url, timeout=2, headers=headers)
-        
-        content_type = response.headers.get('Content-Type', '')
-        
-        # Skip if not XML (might be HTML error page, etc.)
-        if 'xml' not in content_type.lower() and not (
-            '<urlset' in response.text or 
-            '<sitemapindex' in response.text
-        ):
-            return []
-            
-        # Check if it's a sitemap index (contains other sitemaps)
-        if '<sitemapindex' in response.text:
-            try:
-                # Parse as sitemap index
-                root = ET.fromstring(response.content)
-                
-                # Define namespace mapping if needed
-                ns = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-                
-                # Find all sitemap URLs in the index (limit to first 3 for speed)
-                count = 0
-                sitemap_locs = root.findall('.//sm:sitemap/sm;loc', ns) or root.findall(".//sitemap/loc")
-
-                # PROCESS CHILD SITEMAPS CONCURRENTLY
-                with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                    future_to_url = {}
-
-                    for sitemap in sitemap_locs[:3]:
-                        child_sitemap_url = sitemap.text.strip()
-                        future = executor.submit(
-                            process_sitemap, child_sitemap_url, headers, start_time, max_total_time
-                        )
-                        future_to_url[future] = child_sitemap_url
-                    
-                    for future in concurrent.futures.as_completed(future_to_url):
-                        child_urls = future.result()
-                        if child_urls:
-                            for url in child_urls:
-                                if url not in seen_urls:
-                                    urls.append(url)
-                                    seen_urls.add(url)
-
-                        if time.time() - start_time >= max_total_time * 0.9:
-                            break
-                
-            except ET.ParseError:
-                # If XML parsing fails, try to extract URLs using string methods
-                count = 0
-                for line in response.text.splitlines():
-                    if '<loc>' in line and '</loc>' in line and count < 3:
-                        start_idx = line.find('<loc>') + 5
-                        end_idx = line.find('</loc>')
-                        if start_idx < end_idx:
-                            child_url = line[start_idx:end_idx].strip()
-                            if child_url.endswith('.xml'):
-                                child_urls = process_sitemap(child_url, headers, start_time, max_total_time)
-                                if child_urls:
-                                    for url in child_urls:
-                                        if url not in seen_urls:
-                                            urls.append(url)
-                                            seen_urls.add(url)
-                                count += 1
-                            elif child_url not in seen_urls:
-                                urls.append(child_url)
-                                seen_urls.add(child_url)
-                    
-        # Process as regular sitemap
-        elif '<urlset' in response.text:
-            try:
-                # Parse as regular sitemap
-                root = ET.fromstring(response.content)
-                
-                # Define namespace mapping
-                ns = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-                
-                # Find all page URLs (limit to first 100 for speed)
-                count = 0
-                for url_element in root.findall('.//sm:url/sm:loc', ns) or root.findall('.//url/loc'):
-                    if count >= 100:  # Limit to first 100 URLs for speed
-                        break
-                    url = url_element.text.strip()
-                    if url not in seen_urls:
-                        urls.append(url)
-                        seen_urls.add(url)
-                        count += 1
-                    
-                    # Check time limit
-                    if time.time() - start_time >= max_total_time * 0.9:  # 90% of allowed time
-                        break
-                        
-            except ET.ParseError:
-                # If XML parsing fails, try to extract URLs using string methods
-                count = 0
-                for line in response.text.splitlines():
-                    if '<loc>' in line and '</loc>' in line:
-                        start_idx = line.find('<loc>') + 5
-                        end_idx = line.find('</loc>')
-                        if start_idx < end_idx:
-                            url = line[start_idx:end_idx].strip()
-                            if url not in seen_urls:
-                                urls.append(url)
-                                seen_urls.add(url)
-                                count += 1
-                                if count >= 100:  # Limit to first 100 URLs
-                                    break
-                                
-    except Exception as e:
-        print(f"Error processing sitemap {sitemap_url}: {str(e)}")
-        
-    return urls
\ No newline at end of file
+        while True:
+            # Keep as many fetches going as the host allows
+            while frontier.pending() and len(running) < per_host_concurrency and not deadline.used(0.9):
+                ticket = next(tickets)
+                running[asyncio.ensure_future(fetch(ticket, *frontier.pop()))] = ticket
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                ticket = running.pop(task)
+                try:
+                    _, depth, result = task.result()
+                except (asyncio.CancelledError, ExtractionCancelled, CircuitOpenError):
+                    raise
+                except Exception as e:
+                    if deadline.cancelled:
+                        raise ExtractionCancelled()
+                    print(f"Error processing sitemap: {str(e)}")
+                    finished[ticket] = None
+                    continue
+                finished[ticket] = (depth, result)
+            take_finished(flush=not running)
+
+            if frontier.exhausted() or deadline.used(0.9):
+                break
+    except CircuitOpenError:
+        # The host stopped answering, keep what we already have
+        pass
+    finally:
+        for task in running:
+            task.cancel()
+
+    # Keep whatever finished behind a fetch that was still running
+    take_finished(flush=True)
+    return frontier.records
+
+
+def _fetch_sitemap(sitemap_url, headers, frontier, deadline):
+    # Fetch and parse one sitemap, returning
+    # ([loc, lastmod, changefreq, priority, alternates] per page, [child sitemap URL, lastmod])
+    cache_key = f"sitemap:v3:{max_urls_per_sitemap}:{sitemap_url}"
+    read_state = {'truncated': False}
+    parse = functools.partial(_parse_sitemap_response, frontier=frontier, read_state=read_state)
+    # A body cut short by the byte budget is not worth keeping
+    return _conditional_get(cache_key, sitemap_url, headers, parse, deadline, stream=True,
+                            cacheable=lambda result: not read_state['truncated'])
+
+def _parse_sitemap_response(response, deadline, frontier=None, read_state=None):
+    # Stream the body into the incremental parser
+    chunks = deadline.guard(response.iter_content(chunk_size=stream_chunk_size))
+    if frontier is not None:
+        chunks = _metered_chunks(chunks, frontier, read_state)
+    urls, child_sitemaps = _parse_sitemap_stream(_gunzip_chunks(chunks), max_urls_per_sitemap)
+    return [urls, child_sitemaps]
+
+def _metered_chunks(chunks, frontier, read_state):
+    # Stop reading once the site's byte budget is spent
+    for chunk in chunks:
+        if not frontier.take_bytes(len(chunk)):
+            if read_state is not None:
+                read_state['truncated'] = True
+            return
+        yield chunk
+
+def _gunzip_chunks(chunks):
+    # Inflate gzip sitemaps (.xml.gz) on the fly, detected by magic bytes
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(GZIP_MAGIC):
+            break
+
+    if not head.startswith(GZIP_MAGIC):
+        if head:
+            yield head
+        yield from chunks
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in itertools.chain([head], chunks):
+        data = chunk
+        # Bound each inflate step so we only decompress what the parser asks for
+        while data:
+            inflated = decompressor.decompress(data, stream_chunk_size)
+            if inflated:
+                yield inflated
+            data = decompressor.unconsumed_tail
+        if decompressor.eof:
+            return
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _parse_sitemap_stream(chunks, max_urls):
+    urls = []
+    child_sitemaps = []
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+    entry = {}  # fields of the current <url>/<sitemap> entry
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+
+        try:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if root is None:
+                        root = element
+                        # Skip anything that isn't a sitemap (might be HTML error page, etc.)
+                        if _local_name(root.tag) not in ('urlset', 'sitemapindex'):
+                            return urls, child_sitemaps
+                    continue
+
+                depth -= 1
+                # Only fields directly under <url>/<sitemap>, not image:loc and friends
+                if depth == 2:
+                    field = SITEMAP_FIELDS.get(element.tag)
+                    if field is not None and element.text:
+                        entry[field] = element.text.strip()
+                    elif element.tag == XHTML_NS + 'link' and element.get('rel') == 'alternate' and element.get('href'):
+                        entry.setdefault('alternates', []).append([element.get('hreflang'), element.get('href')])
+                elif depth == 1:
+                    loc = entry.get('loc')
+                    if loc and _local_name(root.tag) == 'sitemapindex':
+                        child_sitemaps.append([loc, entry.get('lastmod')])
+                    elif loc:
+                        urls.append([loc, entry.get('lastmod'), entry.get('changefreq'),
+                                     entry.get('priority'), entry.get('alternates')])
+                        if len(urls) >= max_urls:  # Stop the transfer once we have enough
+                            return urls, child_sitemaps
+                    entry = {}
+                    # Drop finished <url>/<sitemap> entries to keep memory flat
+                    root.clear()
+
+        except ET.ParseError:
+            # If XML parsing fails, try to extract URLs using string methods
+            if root is not None:
+                is_index = _local_name(root.tag) == 'sitemapindex'
+            elif b'<sitemapindex' in chunk:
+                is_index = True
+            elif b'<urlset' in chunk:
+                is_index = False
+            else:
+                return urls, child_sitemaps
+            return _scan_sitemap_locs(itertools.chain([chunk], chunks), is_index, urls, child_sitemaps, max_urls)
+
+    return urls, child_sitemaps
+
+def _scan_sitemap_locs(chunks, is_index, urls, child_sitemaps, max_urls):
+    # Fallback for malformed XML: pull <loc> values out of the raw stream
+    seen_locs = {entry[0] for entry in urls} | {child[0] for child in child_sitemaps}
+    buffer = b''
+
+    for chunk in chunks:
+        buffer += chunk
+        end = 0
+        for match in LOC_PATTERN.finditer(buffer):
+            end = match.end()
+            loc = unescape(match.group(1).decode('utf-8', 'replace').strip())
+            if not loc or loc in seen_locs:
+                continue
+            seen_locs.add(loc)
+
+            if is_index and loc.endswith(('.xml', '.xml.gz')):
+                child_sitemaps.append([loc, None])
+            else:
+                urls.append([loc, None, None, None, None])
+                if len(urls) >= max_urls:  # Limit to first max_urls URLs
+                    return urls, child_sitemaps
+
+        # Keep only the unmatched tail, bounded in case there is no </loc> at all
+        buffer = buffer[end:][-stream_chunk_size:]
+
+    return urls, child_sitemaps
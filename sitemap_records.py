@@ -0,0 +1,292 @@
+import json
+import sys
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+from url_utils import canonical_url
+
+# Compact per-site table of sitemap entries. Scheme and host are interned once
+# per site, each entry keeps only its path suffix, and lastmod, changefreq and
+# priority live in typed arrays instead of per-URL Python objects. hreflang
+# alternates are stored sparsely, only for the entries that have them.
+
+CHANGEFREQS = ('always', 'hourly', 'daily', 'weekly', 'monthly', 'yearly', 'never')
+_CHANGEFREQ_CODES = {name: code for code, name in enumerate(CHANGEFREQS)}
+
+NO_LASTMOD = 0  # lastmod is stored as epoch seconds
+NO_CHANGEFREQ = -1
+NO_PRIORITY = -1  # priority is stored in thousandths
+
+FORMAT_VERSION = 1
+
+def parse_lastmod(value):
+    # W3C datetime (2024, 2024-05, 2024-05-01, 2024-05-01T10:00:00+02:00) -> epoch seconds
+    if not value:
+        return NO_LASTMOD
+    value = value.strip()
+    if len(value) == 4:
+        value += '-01-01'
+    elif len(value) == 7:
+        value += '-01'
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return NO_LASTMOD
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return max(int(parsed.timestamp()), NO_LASTMOD)
+
+def parse_priority(value):
+    try:
+        priority = float(value)
+    except (TypeError, ValueError):
+        return NO_PRIORITY
+    if not 0 <= priority <= 1:
+        return NO_PRIORITY
+    return int(round(priority * 1000))
+
+def _split_url(url):
+    # 'https://example.com/a/b?c' -> ('https://example.com', '/a/b?c')
+    scheme_end = url.find('://')
+    if scheme_end < 0:
+        return '', url
+    path_start = url.find('/', scheme_end + 3)
+    if path_start < 0:
+        return url, ''
+    return url[:path_start], url[path_start:]
+
+class SitemapRecords:
+    def __init__(self):
+        self.hosts = []  # interned 'scheme://host' prefixes
+        self.paths = []
+        self.host_ids = array('I')
+        self.lastmod = array('q')
+        self.changefreq = array('b')
+        self.priority = array('h')
+
+        # hreflang alternates: entry row, language id, host id, path
+        self.languages = []
+        self.alternate_rows = array('I')
+        self.alternate_languages = array('H')
+        self.alternate_hosts = array('I')
+        self.alternate_paths = []
+
+        self._host_ids = {}
+        self._language_ids = {}
+        # canonical 'scheme://host' -> {canonical path: row}, for deduplication.
+        # Built on first use after from_bytes, a table that is only read never needs it.
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return self.urls()
+
+    def __contains__(self, url):
+        site_rows, path = self._site_rows(url)
+        return path in site_rows
+
+    def _site_rows(self, url, host=None, path=None):
+        # Dedup index of the URL's site and its key path in there: www., trailing
+        # slash and tracking variants of a page share a key
+        key = canonical_url(url)
+        if key is url and path is not None:
+            # Already canonical, as most sitemap URLs are: the key is the stored path
+            site = host
+        else:
+            site, path = _split_url(key)
+        rows = self._index()
+        site_rows = rows.get(site)
+        if site_rows is None:
+            site_rows = rows[site] = {}
+        return site_rows, path
+
+    def _index(self):
+        if self._rows is None:
+            self._rows = {}
+            hosts = self.hosts
+            for row, (host_id, path) in enumerate(zip(self.host_ids, self.paths)):
+                host = hosts[host_id]
+                site_rows, key = self._site_rows(host + path, host, path)
+                site_rows.setdefault(key, row)
+        return self._rows
+
+    def _host_id(self, host):
+        host_id = self._host_ids.get(host)
+        if host_id is None:
+            host_id = self._host_ids[host] = len(self.hosts)
+            self.hosts.append(host)
+        return host_id
+
+    def _language_id(self, language):
+        language_id = self._language_ids.get(language)
+        if language_id is None:
+            language_id = self._language_ids[language] = len(self.languages)
+            self.languages.append(language)
+        return language_id
+
+    def add(self, loc, lastmod=None, changefreq=None, priority=None, alternates=None):
+        # Raw sitemap values, returns False for a URL that is already in the table
+        return self._append(
+            loc,
+            parse_lastmod(lastmod),
+            _CHANGEFREQ_CODES.get((changefreq or '').strip().lower(), NO_CHANGEFREQ),
+            parse_priority(priority),
+            alternates
+        )
+
+    def _append(self, loc, lastmod, changefreq, priority, alternates):
+        # Variants of a page already in the table are skipped
+        host, path = _split_url(loc)
+        site_rows, key = self._site_rows(loc, host, path)
+        if key in site_rows:
+            return False
+
+        host_id = self._host_id(host)
+        row = len(self.paths)
+        site_rows[key] = row
+        self.paths.append(path)
+        self.host_ids.append(host_id)
+        self.lastmod.append(lastmod)
+        self.changefreq.append(changefreq)
+        self.priority.append(priority)
+
+        for language, href in alternates or ():
+            alternate_host, alternate_path = _split_url(href)
+            self.alternate_rows.append(row)
+            self.alternate_languages.append(self._language_id(language or ''))
+            self.alternate_hosts.append(self._host_id(alternate_host))
+            self.alternate_paths.append(alternate_path)
+        return True
+
+    def add_entries(self, entries, limit=None):
+        # Entries as produced by the sitemap parser: [loc, lastmod, changefreq, priority, alternates]
+        for entry in entries:
+            if limit is not None and len(self.paths) >= limit:
+                break
+            self.add(*entry)
+
+    def add_urls(self, urls, limit=None):
+        for url in urls:
+            if limit is not None and len(self.paths) >= limit:
+                break
+            self.add(url)
+
+    def merge(self, other, limit=None):
+        # Copy another site's entries in, keeping their parsed metadata
+        alternates = {}
+        for i, row in enumerate(other.alternate_rows):
+            alternates.setdefault(row, []).append(
+                (other.languages[other.alternate_languages[i]], other.hosts[other.alternate_hosts[i]] + other.alternate_paths[i])
+            )
+        for row in range(len(other)):
+            if limit is not None and len(self.paths) >= limit:
+                break
+            self._append(other.url(row), other.lastmod[row], other.changefreq[row], other.priority[row],
+                         alternates.get(row))
+
+    def url(self, row):
+        return self.hosts[self.host_ids[row]] + self.paths[row]
+
+    def urls(self):
+        hosts = self.hosts
+        for host_id, path in zip(self.host_ids, self.paths):
+            yield hosts[host_id] + path
+
+    def entry(self, row):
+        changefreq = self.changefreq[row]
+        priority = self.priority[row]
+        return {
+            'loc': self.url(row),
+            'lastmod': self.lastmod[row] or None,
+            'changefreq': CHANGEFREQS[changefreq] if changefreq != NO_CHANGEFREQ else None,
+            'priority': priority / 1000 if priority != NO_PRIORITY else None,
+            'alternates': self.alternates(row),
+        }
+
+    def alternates(self, row):
+        return [
+            (self.languages[self.alternate_languages[i]], self.hosts[self.alternate_hosts[i]] + self.alternate_paths[i])
+            for i, alternate_row in enumerate(self.alternate_rows) if alternate_row == row
+        ]
+
+    def ranked_rows(self, limit=None):
+        # Most recently modified first, then by priority; entries without a
+        # lastmod keep their sitemap order after the dated ones
+        lastmod = self.lastmod
+        priority = self.priority
+        rows = sorted(range(len(self.paths)), key=lambda row: (-lastmod[row], -priority[row], row))
+        return rows[:limit] if limit is not None else rows
+
+    def ranked_urls(self, limit=None):
+        return [self.url(row) for row in self.ranked_rows(limit)]
+
+    def to_bytes(self):
+        # zlib-compressed blob for Mongo (BSON binary) and Parquet (binary column)
+        header = json.dumps({
+            'version': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'hosts': self.hosts,
+            'languages': self.languages,
+            'rows': len(self.paths),
+            'alternates': len(self.alternate_paths),
+        }).encode()
+        parts = [
+            len(header).to_bytes(4, 'little'), header,
+            self.host_ids.tobytes(), self.lastmod.tobytes(),
+            self.changefreq.tobytes(), self.priority.tobytes(),
+            self.alternate_rows.tobytes(), self.alternate_languages.tobytes(), self.alternate_hosts.tobytes(),
+            # URLs never contain a raw newline
+            '\n'.join(self.paths + self.alternate_paths).encode(),
+        ]
+        return zlib.compress(b''.join(parts), 6)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(data)
+        header_size = int.from_bytes(data[:4], 'little')
+        header = json.loads(data[4:4 + header_size])
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported sitemap records version {header['version']}")
+
+        records = cls()
+        records.hosts = header['hosts']
+        records.languages = header['languages']
+        rows = header['rows']
+        alternates = header['alternates']
+
+        offset = 4 + header_size
+        for name, count in (('host_ids', rows), ('lastmod', rows), ('changefreq', rows), ('priority', rows),
+                            ('alternate_rows', alternates), ('alternate_languages', alternates),
+                            ('alternate_hosts', alternates)):
+            column = getattr(records, name)
+            size = column.itemsize * count
+            column.frombytes(data[offset:offset + size])
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            offset += size
+
+        text = data[offset:].decode()
+        strings = text.split('\n') if rows + alternates else []
+        records.paths = strings[:rows]
+        records.alternate_paths = strings[rows:]
+
+        records._host_ids = {host: host_id for host_id, host in enumerate(records.hosts)}
+        records._language_ids = {language: language_id for language_id, language in enumerate(records.languages)}
+        records._rows = None
+        return records
+
+    def __getstate__(self):
+        # Sent between the scrape processes and the pipeline in the compact form
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        self.__dict__.update(SitemapRecords.from_bytes(state).__dict__)
+
+def urls_from_bytes(data):
+    # Ranked page URLs of a stored table, for readers that only need the URLs
+    if not data:
+        return []
+    return SitemapRecords.from_bytes(bytes(data)).ranked_urls()
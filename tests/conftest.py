@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The modules live at the repository root. Keep imports from touching real
+# services or writing cache files, as the benchmarks do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+os.environ.setdefault('MONGO_URI', 'mongodb://127.0.0.1:1')
+os.environ.setdefault('HTTP_CACHE_ENABLED', '0')
+os.environ.setdefault('AI_CACHE_BACKEND', 'none')
+os.environ.setdefault('AI_WARM_UP', '0')
@@ -0,0 +1,73 @@
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+class Ignored(Exception):
+    pass
+
+def fail():
+    raise RuntimeError('down')
+
+def ignored():
+    raise Ignored()
+
+def test_opens_when_failure_rate_crosses_threshold():
+    breaker = CircuitBreaker('test', failure_rate_threshold=0.5, minimum_calls=4, reset_timeout=60)
+    breaker.call(lambda: 'ok')
+    breaker.call(lambda: 'ok')
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.state == CLOSED
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+    assert breaker.snapshot()['rejected'] == 1
+
+def test_stays_closed_below_minimum_calls():
+    breaker = CircuitBreaker('test', minimum_calls=5)
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+    assert breaker.state == CLOSED
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = CircuitBreaker('test', minimum_calls=1, reset_timeout=0)
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # one probe at a time
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    breaker.call(lambda: 'ok')
+    assert breaker.state == CLOSED
+
+def test_ignored_exceptions_release_the_probe_without_counting():
+    breaker = CircuitBreaker('test', minimum_calls=1, reset_timeout=0, ignored_exceptions=(Ignored,))
+    for _ in range(3):
+        with pytest.raises(Ignored):
+            breaker.call(ignored)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()['failures'] == 0
+
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.allow()
+    breaker.release()
+    # The released probe slot is free again
+    assert breaker.allow()
+
+def test_registry_keeps_most_recent_breakers():
+    registry = CircuitBreakerRegistry(max_entries=2, minimum_calls=1)
+    first = registry.get('a.example')
+    registry.get('b.example')
+    assert registry.get('a.example') is first
+    registry.get('c.example')
+    assert set(registry.snapshot()['endpoints']) == {'a.example', 'c.example'}
+    assert registry.get('a.example').minimum_calls == 1
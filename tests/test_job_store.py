@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from job_store import SQLiteJobStore, QueueFull
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'), capacity=3)
+
+def test_claim_complete_and_fail(store):
+    store.enqueue('a', 'batch', {'company_name': 'A'})
+    time.sleep(0.01)
+    store.enqueue('b', 'batch', {'company_name': 'B'})
+
+    assert store.claim() == ('a', {'company_name': 'A'})
+    assert store.claim() == ('b', {'company_name': 'B'})
+    assert store.claim() is None
+
+    store.complete('a', {'Company': 'A'})
+    store.fail('b', 'scrape failed')
+    assert store.get('a') == {'status': 'complete', 'data': {'Company': 'A'}}
+    assert store.get('b') == {'status': 'error', 'message': 'scrape failed'}
+    assert store.counts() == {'complete': 1, 'error': 1}
+
+    progress = store.batch_progress('batch')
+    assert (progress['total'], progress['complete'], progress['error']) == (2, 1, 1)
+
+def test_repeated_dedup_keys_are_skipped(store):
+    inserted = store.enqueue_many('batch', [('a', {}, 'acme'), ('b', {}, 'acme'), ('c', {}, None)])
+    assert inserted == 2
+    assert store.pending_count() == 2
+    # The same key in another batch is a new job
+    assert store.enqueue_many('other', [('d', {}, 'acme')]) == 1
+
+def test_job_finishes_once(store):
+    store.enqueue('a', 'batch', {})
+    store.claim()
+    store.complete('a', {'Company': 'A'})
+    # A requeued copy finishing later doesn't overwrite or count twice
+    store.fail('a', 'late failure')
+    assert store.get('a')['status'] == 'complete'
+    assert store.batch_progress('batch')['error'] == 0
+
+def test_full_queue_raises_after_timeout(store):
+    store.enqueue_many('batch', [('a', {}, None), ('b', {}, None)])
+    started = time.time()
+    with pytest.raises(QueueFull):
+        store.enqueue_many('batch', [('c', {}, None), ('d', {}, None)], timeout=0.2)
+    assert time.time() - started >= 0.2
+    assert store.pending_count() == 2
+
+def test_wait_for_room_counts_the_whole_upload(store):
+    store.wait_for_room(3, timeout=0)
+    with pytest.raises(QueueFull):
+        store.wait_for_room(4, timeout=0)
+
+def test_admitted_jobs_skip_the_capacity_check(store):
+    store.enqueue_many('batch', [('a', {}, None), ('b', {}, None), ('c', {}, None)])
+    store.wait_for_room(10, timeout=None)
+    assert store.enqueue('d', 'batch', {}, timeout=None) == 1
+    assert store.pending_count() == 4
+
+def test_stale_claims_are_requeued(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'), visibility_timeout=0)
+    store.enqueue('a', 'batch', {})
+    store.claim()
+    time.sleep(0.01)
+    assert store.requeue_stale() == 1
+    assert store.claim() == ('a', {})
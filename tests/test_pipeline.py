@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+import health
+from pipeline import Pipeline
+from sitemap_records import SitemapRecords
+
+class FakeJobStore:
+    # Records finished jobs, each hook can be replaced to raise
+    def __init__(self, jobs=()):
+        self.jobs = list(jobs)
+        self.completed = {}
+        self.failed = {}
+        self.lock = threading.Lock()
+
+    def claim(self):
+        with self.lock:
+            return self.jobs.pop(0) if self.jobs else None
+
+    def complete(self, job_id, result):
+        self.completed[job_id] = result
+
+    def fail(self, job_id, message):
+        self.failed[job_id] = message
+
+class FakeWriter:
+    def __init__(self):
+        self.documents = []
+
+    def add(self, document):
+        self.documents.append(document)
+
+@pytest.fixture
+def make_pipeline():
+    pipelines = []
+
+    def make(job_store):
+        pipeline = Pipeline(job_store, scrape_workers=0, ai_workers=0, poll_interval=0.01)
+        pipeline.company_writer.close()
+        pipeline.company_writer = FakeWriter()
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline._stopping.set()
+        for t in pipeline._threads:
+            t.join(1)
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+def records_blob(*urls):
+    records = SitemapRecords()
+    records.add_urls(urls)
+    return records.to_bytes()
+
+def test_store_worker_survives_a_job_store_error(make_pipeline):
+    job_store = FakeJobStore()
+    pipeline = make_pipeline(job_store)
+
+    def complete(job_id, result):
+        if job_id == 'bad':
+            raise RuntimeError('database is locked')
+        job_store.completed[job_id] = result
+    job_store.complete = complete
+
+    pipeline._spawn(pipeline._store_worker, 'store')
+    pipeline.store_queue.put(('bad', 'Bad', 'https://bad.example', records_blob('https://bad.example/'), 'insight', 'fp'))
+    pipeline.store_queue.put(('good', 'Good', 'https://good.example', records_blob('https://good.example/a'), 'insight', 'fp'))
+
+    wait_for(lambda: 'good' in job_store.completed)
+    assert job_store.failed == {'bad': 'database is locked'}
+    assert job_store.completed['good']['Sitemap URLs'] == ['https://good.example/a']
+    assert pipeline.dead_stages() == []
+    assert pipeline.store_stats.snapshot()['errors'] == 1
+
+    # Only the records blob is stored with the company, not the URL list
+    document = pipeline.company_writer.documents[-1]
+    assert 'sitemap_urls' not in document
+    assert document['sitemap_metadata'] == records_blob('https://good.example/a')
+
+def test_failed_job_store_update_leaves_the_job_claimed(make_pipeline):
+    job_store = FakeJobStore()
+    pipeline = make_pipeline(job_store)
+
+    def broken(job_id, *args):
+        raise RuntimeError('connection lost')
+    job_store.complete = job_store.fail = broken
+
+    pipeline._spawn(pipeline._store_worker, 'store')
+    pipeline.store_queue.put(('a', 'A', 'https://a.example', records_blob('https://a.example/'), 'insight', 'fp'))
+    wait_for(lambda: pipeline.store_stats.snapshot()['processed'] == 1)
+    assert pipeline.dead_stages() == []
+
+def test_scrape_worker_survives_claim_and_scrape_errors(make_pipeline):
+    job_store = FakeJobStore([
+        ('broken', {'company_name': 'Broken', 'website_url': 'https://broken.example'}),
+        ('ok', {'company_name': 'Ok', 'website_url': 'https://ok.example'}),
+    ])
+    pipeline = make_pipeline(job_store)
+
+    claims = []
+    claim = job_store.claim
+    def flaky_claim():
+        claims.append(1)
+        if len(claims) == 1:
+            raise RuntimeError('database is locked')
+        return claim()
+    job_store.claim = flaky_claim
+
+    def scrape(website_url):
+        if 'broken' in website_url:
+            raise RuntimeError('no sitemap')
+        records = SitemapRecords()
+        records.add_urls(['https://ok.example/a', 'https://ok.example/b'])
+        return records
+    pipeline._scrape = scrape
+
+    pipeline._spawn(pipeline._scrape_worker, 'scrape')
+    job_id, company_name, website_url, sitemap_metadata, url_count, fingerprint = pipeline.ai_queue.get(timeout=2)
+
+    assert (job_id, url_count) == ('ok', 2)
+    assert SitemapRecords.from_bytes(sitemap_metadata).ranked_urls() == ['https://ok.example/a', 'https://ok.example/b']
+    assert job_store.failed == {'broken': 'no sitemap'}
+    assert pipeline.scrape_stats.snapshot()['errors'] == 1
+    assert pipeline.dead_stages() == []
+
+def test_dead_stages_reports_stages_without_live_workers(make_pipeline):
+    pipeline = make_pipeline(FakeJobStore())
+    assert pipeline.dead_stages() == []
+
+    pipeline._spawn(lambda: None, 'ai')
+    pipeline._spawn(pipeline._store_worker, 'store')
+    wait_for(lambda: not pipeline._stage_threads['ai'][0].is_alive())
+    assert pipeline.dead_stages() == ['ai']
+    assert health.pipeline_check(pipeline) == (health.DOWN, 'error: no ai workers running')
@@ -0,0 +1,32 @@
+import time
+
+from rate_limiter import RateLimiter
+
+def test_acquire_times_out_when_the_bucket_is_empty():
+    # One request per minute with a burst of one
+    limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=1000000, burst_seconds=60)
+    assert limiter.acquire(timeout=0)
+    started = time.monotonic()
+    assert not limiter.acquire(timeout=0.1)
+    assert time.monotonic() - started < 1
+    assert limiter.snapshot()['timed_out'] == 1
+
+def test_token_budget_limits_large_prompts():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600, burst_seconds=10)
+    assert limiter.acquire(tokens=100, timeout=0)
+    assert not limiter.acquire(tokens=100, timeout=0)
+
+def test_oversized_request_is_capped_to_the_bucket():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=600, burst_seconds=10)
+    assert limiter.acquire(tokens=10000, timeout=0)
+
+def test_throttled_pauses_and_halves_the_rate():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=1000000, recovery_step=0.25)
+    limiter.throttled(retry_after=0.2)
+    assert limiter.rate_fraction == 0.5
+    assert not limiter.acquire(timeout=0.05)
+    assert limiter.acquire(timeout=1)
+
+    limiter.succeeded()
+    limiter.succeeded()
+    assert limiter.rate_fraction == 1.0
@@ -0,0 +1,68 @@
+import pickle
+
+from sitemap_records import SitemapRecords, urls_from_bytes
+
+def test_variants_of_a_page_are_deduplicated():
+    records = SitemapRecords()
+    assert records.add('https://a.com/x')
+    assert not records.add('https://www.a.com/x/')
+    assert not records.add('https://a.com/x?utm_source=mail')
+    assert records.add('https://a.com/y')
+    assert len(records) == 2
+    assert 'https://WWW.a.com/y' in records
+    assert list(records) == ['https://a.com/x', 'https://a.com/y']
+
+def test_metadata_parsing_and_ranking():
+    records = SitemapRecords()
+    records.add('https://a.com/old', lastmod='2020-01-01', priority='0.9')
+    records.add('https://a.com/undated', changefreq='Weekly')
+    records.add('https://a.com/new', lastmod='2024-05-01T10:00:00Z', priority='bad')
+
+    assert records.ranked_urls() == ['https://a.com/new', 'https://a.com/old', 'https://a.com/undated']
+    assert records.ranked_urls(limit=1) == ['https://a.com/new']
+    entry = records.entry(1)
+    assert entry['changefreq'] == 'weekly'
+    assert entry['lastmod'] is None
+    assert records.entry(0)['priority'] == 0.9
+    assert records.entry(2)['priority'] is None
+
+def test_round_trip_keeps_entries_and_alternates():
+    records = SitemapRecords()
+    records.add('https://a.com/x', lastmod='2024-01-01', changefreq='daily', priority='0.5',
+                alternates=[('de', 'https://a.de/x'), ('fr', 'https://a.com/fr/x')])
+    records.add('https://b.com/y')
+
+    restored = SitemapRecords.from_bytes(records.to_bytes())
+    assert len(restored) == 2
+    assert [restored.entry(row) for row in range(2)] == [records.entry(row) for row in range(2)]
+    assert pickle.loads(pickle.dumps(records)).ranked_urls() == records.ranked_urls()
+
+def test_empty_table_round_trip():
+    assert len(SitemapRecords.from_bytes(SitemapRecords().to_bytes())) == 0
+    assert urls_from_bytes(None) == []
+    assert urls_from_bytes(SitemapRecords().to_bytes()) == []
+
+def test_dedup_index_is_built_lazily_after_loading():
+    records = SitemapRecords()
+    records.add_urls(['https://a.com/x', 'https://a.com/y'])
+    restored = SitemapRecords.from_bytes(records.to_bytes())
+
+    # Reading doesn't need the index
+    assert urls_from_bytes(records.to_bytes()) == ['https://a.com/x', 'https://a.com/y']
+    assert restored.ranked_urls() == ['https://a.com/x', 'https://a.com/y']
+    assert restored._rows is None
+
+    # Adding builds it, so variants of loaded pages are still skipped
+    assert not restored.add('https://www.a.com/x/')
+    assert restored.add('https://a.com/z')
+    assert len(restored) == 3
+
+def test_merge_respects_limit_and_dedup():
+    first = SitemapRecords()
+    first.add_urls(['https://a.com/x', 'https://a.com/y'])
+    second = SitemapRecords()
+    second.add('https://a.com/y/', lastmod='2024-01-01')
+    second.add_urls(['https://a.com/z', 'https://a.com/w'])
+
+    first.merge(second, limit=3)
+    assert list(first) == ['https://a.com/x', 'https://a.com/y', 'https://a.com/z']
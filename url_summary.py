@@ -0,0 +1,196 @@
+import os
+
+from url_utils import canonical_url
+from rate_limiter import estimate_tokens
+
+# Before a site's URLs go into a prompt they are put into a path-prefix trie.
+# Large repetitive sections ("/blog/...", "/products/...") are collapsed into
+# one "/blog/* (4,210 pages)" line, and the prompt gets a deduplicated sample
+# that spreads over every part of the site instead of an arbitrary slice.
+
+# A prefix with at least this many pages below it, spread over at least this
+# many children (or ten times as many pages in any shape), is collapsed
+collapse_min_pages = int(os.getenv('URL_SUMMARY_COLLAPSE_PAGES', '20'))
+collapse_min_children = int(os.getenv('URL_SUMMARY_COLLAPSE_CHILDREN', '10'))
+
+# Example pages listed in the sample for each collapsed section
+examples_per_section = int(os.getenv('URL_SUMMARY_EXAMPLES', '3'))
+
+# Estimated tokens for the URL part of one company's prompt
+default_token_budget = int(os.getenv('AI_PROMPT_URL_TOKENS', '1000'))
+
+class _Node:
+    __slots__ = ('children', 'urls', 'count')
+
+    def __init__(self):
+        self.children = {}
+        self.urls = []  # (input position, URL) of pages whose path ends at this node
+        self.count = 0  # pages at or below this node
+
+class UrlSummary:
+    def __init__(self, total, sections, sample, omitted_sections=0, omitted_pages=0):
+        self.total = total  # unique pages summarized
+        self.sections = sections  # [(pattern, page count)], largest first
+        self.sample = sample  # representative page URLs
+        self.omitted_sections = omitted_sections
+        self.omitted_pages = omitted_pages
+
+    @property
+    def summarized(self):
+        return bool(self.sections) or len(self.sample) < self.total
+
+    def lines(self):
+        # Prompt lines: collapsed sections first, then the sample. A small site
+        # that needs no summarizing comes out as its plain URL list.
+        lines = [f"{pattern} ({count:,} pages)" for pattern, count in self.sections]
+        if self.omitted_sections:
+            lines.append(f"... {self.omitted_sections:,} more sections ({self.omitted_pages:,} pages)")
+        return lines + self.sample
+
+def _dedupe(urls):
+    # [(url, normalized url)] in input order, first spelling of each page wins
+    seen = set()
+    unique = []
+    for url in urls:
+        if not url or not url.strip():
+            continue
+        key = canonical_url(url)
+        if key not in seen:
+            seen.add(key)
+            unique.append((url, key))
+    return unique
+
+def _host_and_path(key):
+    # Cheap split of an already normalized URL, query dropped
+    scheme_end = key.find('://')
+    rest = key[scheme_end + 3:] if scheme_end >= 0 else key
+    slash = rest.find('/')
+    if slash < 0:
+        return rest, ''
+    return rest[:slash], rest[slash:].split('?', 1)[0]
+
+def _build_trie(unique):
+    root = _Node()
+    split = [_host_and_path(key) for _, key in unique]
+
+    # The host is only part of the pattern when a site spans several hosts
+    multi_host = len({host for host, _ in split}) > 1
+    for position, ((url, _), (host, path)) in enumerate(zip(unique, split)):
+        segments = [segment for segment in path.split('/') if segment]
+        if multi_host:
+            segments.insert(0, host)
+
+        node = root
+        node.count += 1
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+            node.count += 1
+        node.urls.append((position, url))
+
+    return root, multi_host
+
+def _pattern(segments, multi_host):
+    if multi_host:
+        return '/'.join(segments) + '/*'
+    return '/' + '/'.join(segments) + '/*'
+
+def _should_collapse(node):
+    if node.count < collapse_min_pages:
+        return False
+    return len(node.children) >= collapse_min_children or node.count >= collapse_min_pages * 10
+
+def _examples(node, limit):
+    # Shallowest pages first: the section's landing page, then its direct children
+    examples = []
+    level = [node]
+    while level and len(examples) < limit:
+        next_level = []
+        for current in level:
+            examples.extend(current.urls[:limit - len(examples)])
+            if len(examples) >= limit:
+                break
+            next_level.extend(current.children.values())
+        level = next_level
+    return examples
+
+def _collect(root, multi_host):
+    # Walk the trie, collapsing big sections and keeping everything else as pages.
+    # Returns sections and {top-level group: [(depth, input position, url)]};
+    # top-level pages without anything below them share the '' group.
+    sections = []
+    groups = {}
+
+    stack = [(root, [])]
+    while stack:
+        node, segments = stack.pop()
+        if len(segments) > 1 or (segments and node.children):
+            group = groups.setdefault(segments[0], [])
+        else:
+            group = groups.setdefault('', [])
+        for position, url in node.urls:
+            group.append((len(segments), position, url))
+
+        for name, child in node.children.items():
+            child_segments = segments + [name]
+            # With several hosts the host level itself is never collapsed
+            if _should_collapse(child) and not (multi_host and not segments):
+                sections.append((_pattern(child_segments, multi_host), child.count))
+                section_group = groups.setdefault(child_segments[0], [])
+                for position, url in _examples(child, examples_per_section):
+                    section_group.append((len(child_segments), position, url))
+            else:
+                stack.append((child, child_segments))
+
+    sections.sort(key=lambda section: -section[1])
+    return sections, groups
+
+def _round_robin(groups):
+    # One page from each part of the site in turn, shallow pages first and
+    # in their original (ranked) order within a depth. Top-level pages
+    # (/about, /pricing) go first, then the biggest parts of the site.
+    queues = [sorted(pages) for group, pages in sorted(groups.items(), key=lambda item: (item[0] != '', -len(item[1]))) if pages]
+    index = 0
+    while queues:
+        for pages in queues:
+            if index < len(pages):
+                yield pages[index][2]
+        index += 1
+        queues = [pages for pages in queues if index < len(pages)]
+
+def summarize_urls(urls, token_budget=None):
+    if token_budget is None:
+        token_budget = default_token_budget
+
+    unique = _dedupe(urls)
+    total = len(unique)
+
+    # Small sites go through unchanged, in their original (ranked) order
+    if sum(estimate_tokens(url) + 1 for url, _ in unique) <= token_budget:
+        return UrlSummary(total, [], [url for url, _ in unique])
+
+    root, multi_host = _build_trie(unique)
+    sections, groups = _collect(root, multi_host)
+
+    # Section lines get at most half of the budget, the largest ones first
+    used = 0
+    kept_sections = []
+    for pattern, count in sections:
+        tokens = estimate_tokens(pattern) + 4
+        if used + tokens > token_budget // 2:
+            break
+        kept_sections.append((pattern, count))
+        used += tokens
+    omitted = sections[len(kept_sections):]
+
+    sample = []
+    for url in _round_robin(groups):
+        tokens = estimate_tokens(url) + 1
+        if used + tokens > token_budget:
+            break
+        sample.append(url)
+        used += tokens
+
+    return UrlSummary(total, kept_sections, sample, len(omitted), sum(count for _, count in omitted))
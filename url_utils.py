@@ -0,0 +1,86 @@
+import functools
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+# One definition of URL identity, shared by the scraper, CSV ingestion, the
+# database and the AI cache. canonical_url() is an identity key, not a URL to
+# fetch: scheme and host are lowercased, default ports, "www.", fragments,
+# tracking parameters and trailing slashes are dropped.
+
+# Query parameters that only track where a visitor came from
+TRACKING_PARAMS = frozenset((
+    'gclid', 'dclid', 'gbraid', 'wbraid', 'fbclid', 'msclkid', 'yclid', 'twclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'ref', 'ref_src', 'spm',
+))
+TRACKING_PREFIXES = ('utm_', 'pk_')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Results of the slow path are memoized, sitemaps repeat the same URLs a lot
+cache_size = int(os.getenv('URL_CANONICAL_CACHE_SIZE', '65536'))
+
+# Already canonical: lowercase http(s) scheme and host, no www., port, query,
+# fragment or trailing slash. Most sitemap URLs look like this and skip urlsplit.
+_CANONICAL_PATTERN = re.compile(r'https?://(?!www\.)[a-z0-9-]+(?:\.[a-z0-9-]+)*(?:/[^?#\s]*[^/?#\s])?')
+
+def _is_tracking(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def _clean_host(host):
+    host = host.lower().rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+def canonical_url(url):
+    if _CANONICAL_PATTERN.fullmatch(url):
+        return url
+    return _canonicalize(url)
+
+@functools.lru_cache(maxsize=cache_size)
+def _canonicalize(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    try:
+        host = _clean_host(parts.hostname or '')
+        port = parts.port
+    except ValueError:
+        # Malformed port, keep the network location as written
+        netloc = parts.netloc.lower()
+    else:
+        if ':' in host:  # IPv6 literal
+            host = f'[{host}]'
+        netloc = host if port is None or port == DEFAULT_PORTS.get(scheme) else f'{host}:{port}'
+
+    query = '&'.join(
+        pair for pair in parts.query.split('&')
+        if pair and not _is_tracking(pair.split('=', 1)[0])
+    )
+    return urlunsplit((scheme, netloc, parts.path.rstrip('/'), query, ''))
+
+@functools.lru_cache(maxsize=cache_size)
+def normalize_host(url):
+    # 'HTTPS://WWW.Example.com:443/about' or 'example.com' -> 'example.com'.
+    # A non-default port stays, 'example.com:8080' is a different site.
+    url = url.strip()
+    scheme = None
+    if '://' in url:
+        scheme = url.split('://', 1)[0].lower()
+    else:
+        url = '//' + url
+    try:
+        parts = urlsplit(url)
+        host = _clean_host(parts.hostname or '')
+        port = parts.port
+    except ValueError:
+        return ''
+    if ':' in host:  # IPv6 literal
+        host = f'[{host}]'
+    default_ports = (DEFAULT_PORTS[scheme],) if scheme in DEFAULT_PORTS else tuple(DEFAULT_PORTS.values())
+    if port is None or port in default_ports:
+        return host
+    return f'{host}:{port}'
+
+def same_site(a, b):
+    return bool(a) and bool(b) and normalize_host(a) == normalize_host(b)
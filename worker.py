@@ -0,0 +1,66 @@
+import argparse
+import multiprocessing
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables before the pipeline modules read them
+load_dotenv()
+
+from database import init_db
+from job_store import create_job_store
+from pipeline import Pipeline, pipeline_config_from_env
+
+def run_pipeline(config, stats_interval):
+    # One pipeline per process, all consuming the same job store
+    init_db()
+    pipeline = Pipeline(create_job_store(), **config)
+    pipeline.start()
+    try:
+        while True:
+            time.sleep(stats_interval)
+            print(f"Pipeline stats: {pipeline.stats()}")
+    except KeyboardInterrupt:
+        pipeline.stop()
+
+def main():
+    defaults = pipeline_config_from_env()
+
+    parser = argparse.ArgumentParser(description='Run sitemap analysis workers without the web server.')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--scrape-workers', type=int, default=defaults['scrape_workers'])
+    parser.add_argument('--scrape-processes', type=int, default=defaults['scrape_processes'],
+                        help='run sitemap extraction in this many child processes (0 = threads only)')
+    parser.add_argument('--ai-workers', type=int, default=defaults['ai_workers'])
+    parser.add_argument('--store-batch-size', type=int, default=defaults['store_batch_size'])
+    parser.add_argument('--store-flush-interval', type=float, default=defaults['store_flush_interval'])
+    parser.add_argument('--queue-size', type=int, default=defaults['queue_size'])
+    parser.add_argument('--poll-interval', type=float, default=defaults['poll_interval'])
+    parser.add_argument('--ai-batch-wait', type=float, default=defaults['ai_batch_wait'],
+                        help='seconds an AI worker waits to fill a batch when AI_BATCHING=1')
+    parser.add_argument('--freshness-window', type=float, default=defaults['freshness_window'],
+                        help='seconds a stored analysis counts as fresh for incremental uploads')
+    parser.add_argument('--stats-interval', type=float, default=60)
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in defaults}
+
+    if args.processes <= 1:
+        run_pipeline(config, args.stats_interval)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_pipeline, args=(config, args.stats_interval))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+if __name__ == '__main__':
+    main()